@@ -0,0 +1,225 @@
+"""
+Host-wide caches, shared by all pickley base folders on a machine
+
+Layout::
+
+    <version_cache>/
+        <index hash>/
+            <package>.json          # Latest version determined from <index>, with its validators
+
+    <wheel_cache>/
+        <name>-<version>-<tags>.whl # Wheels built or downloaded by any install (mtime tracks last use)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+import runez
+
+from pickley import system
+from pickley.delivery import clone_file
+
+
+LOG = logging.getLogger(__name__)
+SHARED_FIELDS = ("version", "source", "timestamp", "etag", "last_modified", "serial")
+
+
+def ensure_shared_folder(folder):
+    """
+    :param str folder: Cache folder to create if needed, writable by all users (pickley installations of several users share it)
+    """
+    if os.path.isdir(folder):
+        return
+
+    try:
+        os.makedirs(folder)
+
+    except OSError:
+        if not os.path.isdir(folder):
+            raise
+
+        return  # Created concurrently by another pickley process
+
+    # Via chmod rather than umask: umask is process-wide, other threads could be creating files in the meantime
+    os.chmod(folder, 0o777)
+
+
+class VersionCache(object):
+    """Latest versions, keyed by (index, package), readable and writable concurrently by several pickley processes"""
+
+    def __init__(self, folder):
+        """
+        :param str folder: Path to folder holding the cache
+        """
+        self.folder = folder
+
+    def __repr__(self):
+        return runez.short(self.folder)
+
+    def path(self, index, package_spec):
+        """
+        :param str index: Pypi index the version came from
+        :param system.PackageSpec package_spec: Associated pypi package
+        :return str: Path to cache entry for 'package_spec' on 'index'
+        """
+        key = hashlib.sha1((index or "pypi").encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.folder, key, "%s.json" % package_spec.dashed)
+
+    def get(self, index, package_spec):
+        """
+        :param str index: Pypi index to look up
+        :param system.PackageSpec package_spec: Associated pypi package
+        :return dict|None: Cached latest version info, if still recent enough
+        """
+        data = runez.read_json(self.path(index, package_spec), default=None, fatal=False)
+        if not isinstance(data, dict) or not data.get("version"):
+            return None
+
+        try:
+            if (int(time.time()) - int(data.get("timestamp"))) < system.SETTINGS.version_check_seconds:
+                return data
+
+        except (TypeError, ValueError):
+            pass
+
+    def put(self, index, package_spec, meta):
+        """
+        :param str index: Pypi index 'meta' was determined from
+        :param system.PackageSpec package_spec: Associated pypi package
+        :param pickley.package.VersionMeta meta: Latest version to share with other pickley installations on this host
+        """
+        if runez.DRYRUN:
+            LOG.debug("Would update %s", runez.short(self.path(index, package_spec)))
+            return
+
+        path = self.path(index, package_spec)
+        data = dict((key, getattr(meta, key)) for key in SHARED_FIELDS)
+        try:
+            folder = os.path.dirname(path)
+            ensure_shared_folder(self.folder)
+            ensure_shared_folder(folder)
+
+            # Write to a temp file in same folder, then rename: readers never see a partially written entry
+            fd, temp = tempfile.mkstemp(prefix=".%s." % package_spec.dashed, dir=folder)
+            try:
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(data, fh, sort_keys=True)
+
+                os.chmod(temp, 0o644)
+                os.rename(temp, path)
+
+            except Exception:
+                runez.delete(temp, fatal=False, logger=None)
+                raise
+
+        except (IOError, OSError) as e:
+            # Cache is best effort only
+            LOG.debug("Can't update %s: %s", runez.short(path), e)
+
+
+class WheelCache(object):
+    """
+    Wheels keyed by their file name (name, version and compatibility tags), shared by all packages being installed
+
+    Wheels are immutable once published: a wheel built once from an sdist (C extensions etc) can be reused by any
+    later install, without re-downloading or recompiling it. Least recently used wheels are evicted past 'budget'.
+    """
+
+    def __init__(self, folder, budget):
+        """
+        :param str folder: Path to folder holding the cache
+        :param int budget: Size in bytes that cache should not exceed
+        """
+        self.folder = folder
+        self.budget = budget
+
+    def __repr__(self):
+        return runez.short(self.folder)
+
+    def store(self, folder, exclude=None):
+        """
+        Add wheels from 'folder' to cache, mark those already cached as recently used
+
+        :param str folder: Folder containing wheels (typically a build folder 'pip wheel' just ran in)
+        :param callable|None exclude: Optional function telling which wheels should not be cached
+        :return int: Number of wheels added to cache
+        """
+        if not os.path.isdir(folder):
+            return 0
+
+        if runez.DRYRUN:
+            LOG.debug("Would update %s", runez.short(self.folder))
+            return 0
+
+        added = 0
+        now = time.time()
+        for fname in sorted(os.listdir(folder)):
+            if not fname.endswith(".whl") or (exclude and exclude(fname)):
+                continue
+
+            path = os.path.join(self.folder, fname)
+            try:
+                if os.path.exists(path):
+                    os.utime(path, (now, now))
+                    continue
+
+                ensure_shared_folder(self.folder)
+
+                # Clone to a temp file in same folder, then rename: readers never see a partially written wheel
+                fd, temp = tempfile.mkstemp(prefix=".%s." % fname, dir=self.folder)
+                os.close(fd)
+                try:
+                    clone_file(os.path.join(folder, fname), temp, hardlink=True)
+                    os.chmod(temp, 0o644)
+                    os.utime(temp, (now, now))
+                    os.rename(temp, path)
+                    added += 1
+
+                except Exception:
+                    runez.delete(temp, fatal=False, logger=None)
+                    raise
+
+            except (IOError, OSError) as e:
+                # Cache is best effort only
+                LOG.debug("Can't cache %s: %s", fname, e)
+
+        self.evict()
+        return added
+
+    def evict(self):
+        """
+        Delete least recently used wheels, until cache fits in its budget
+
+        :return int: Number of wheels evicted
+        """
+        if not os.path.isdir(self.folder):
+            return 0
+
+        entries = []
+        total = 0
+        for fname in os.listdir(self.folder):
+            if fname.endswith(".whl"):
+                path = os.path.join(self.folder, fname)
+                try:
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+
+                except OSError:
+                    pass  # Evicted concurrently by another pickley process
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.budget:
+                break
+
+            if runez.delete(path, fatal=False, logger=LOG.debug) > 0:
+                evicted += 1
+
+            total -= size
+
+        return evicted
@@ -4,16 +4,18 @@ See https://github.com/zsimic/pickley
 
 import logging
 import logging.config
+import multiprocessing
 import os
 import sys
 
 import click
 import runez
 
-from pickley import system
+from pickley import garbage, system
 from pickley.delivery import copy_venv, move_venv
 from pickley.lock import SoftLockException
 from pickley.package import DELIVERERS, PACKAGERS
+from pickley.pypi import same_version
 from pickley.settings import short
 from pickley.uninstall import uninstall_existing
 
@@ -27,7 +29,7 @@ LOG = logging.getLogger(__name__)
 @runez.click.debug()
 @runez.click.dryrun("-n")
 @click.option("--base", "-b", metavar="PATH", help="Base installation folder to use (default: folder containing pickley)")
-@click.option("--index", "-i", metavar="PATH", help="Pypi index to use")
+@click.option("--index", "-i", metavar="PATH", help="Pypi index to use (or file:// folder of wheels)")
 @click.option("--config", "-c", metavar="PATH", help="Extra config to load")
 @click.option("--python", "-P", metavar="PATH", help="Python interpreter to use")
 @click.option("--delivery", "-d", type=click.Choice(DELIVERERS.names()), help="Delivery method to use")
@@ -62,9 +64,10 @@ def main(ctx, debug, base, index, config, python, delivery, packager):
 
 @main.command()
 @click.option("--force", "-f", is_flag=True, help="Force check, even if checked recently")
+@click.option("--jobs", "-j", default=1, show_default=True, help="Number of packages to check concurrently")
 @click.option("--verbose", "-v", is_flag=True, help="Show more information")
 @click.argument("packages", nargs=-1, required=False)
-def check(force, verbose, packages):
+def check(force, jobs, verbose, packages):
     """
     Check whether specified packages need an upgrade
     """
@@ -74,16 +77,21 @@ def check(force, verbose, packages):
         print("No packages installed")
 
     else:
-        for name in packages:
+        system.SETTINGS.state.preload()
+
+        def refreshed(name):
             p = PACKAGERS.resolved(name)
             p.refresh_desired(force=force)
+            return p
+
+        for p in system.concurrently(refreshed, packages, jobs=jobs):
             if not p.desired.valid:
                 LOG.error(p.desired.representation(verbose))
                 code = 1
             elif not p.current.version or not p.current.valid:
                 print(p.desired.representation(verbose, note="is not installed"))
                 code = 1
-            elif p.current.version != p.desired.version:
+            elif not same_version(p.current.version, p.desired.version):
                 print(p.current.representation(verbose, note="can be upgraded to %s" % p.desired.version))
                 code = 1
             else:
@@ -103,6 +111,7 @@ def list(verbose):
         print("No packages installed")
 
     else:
+        system.SETTINGS.state.preload()
         for name in packages:
             p = PACKAGERS.resolved(name)
             print(p.current.representation(verbose))
@@ -110,16 +119,77 @@ def list(verbose):
 
 @main.command()
 @click.option("--force", "-f", is_flag=True, help="Force installation, even if already installed")
+@click.option("--jobs", "-j", default=1, show_default=True, help="Number of packages to install concurrently")
+@click.option("--cpu-jobs", type=int, help="Max concurrent builds, with --jobs (default: number of CPUs)")
 @click.argument("packages", nargs=-1, required=True)
-def install(force, packages):
+def install(force, jobs, cpu_jobs, packages):
     """
     Install a package from pypi
     """
     system.setup_audit_log()
     packages = system.resolved_package_specs(packages)
-    for name in packages:
-        p = PACKAGERS.resolved(name)
-        p.install(force=force)
+    changed = False  # Older installs need cleaning up only if at least one package was effectively (re)installed
+    if jobs <= 1 or len(packages) <= 1:
+        try:
+            for name in packages:
+                p = PACKAGERS.resolved(name)
+                if p.install(force=force):
+                    changed = True
+
+        finally:
+            if changed:
+                garbage.schedule()
+
+        return
+
+    def installed(name):
+        with system.deferred_inform() as messages:
+            try:
+                p = PACKAGERS.resolved(name)
+                return True, p.install(force=force), messages
+
+            except SystemExit:
+                # Error was already reported, keep installing other packages
+                messages.append("Failed to install %s" % name)
+                return False, False, messages
+
+    # Version lookups and downloads can run 'jobs' at a time, builds are limited by number of CPUs
+    system.set_throttles(network=jobs, cpu=cpu_jobs or multiprocessing.cpu_count())
+    failed = 0
+    try:
+        for succeeded, effective, messages in system.concurrently(installed, packages, jobs=jobs):
+            for message in messages:
+                print(message)
+
+            if not succeeded:
+                failed += 1
+
+            if effective:
+                changed = True
+
+    finally:
+        system.set_throttles()
+
+    if changed:
+        garbage.schedule()
+
+    if failed:
+        sys.exit(1)
+
+
+@main.command()
+@click.option("--budget", type=int, help="Max size in MB of older installs and tool venvs (default: 'gc_budget' setting)")
+def gc(budget):
+    """
+    Cleanup older installs
+    """
+    collector = garbage.GarbageCollector(budget * 1024 * 1024 if budget else system.SETTINGS.gc_bytes)
+    if not collector.run():
+        print("Skipping garbage collection, already running in another process")
+        return
+
+    msg = "Would delete" if runez.DRYRUN else "Deleted"
+    print("%s %s older installs and %s tool venvs" % (msg, collector.deleted, collector.evicted))
 
 
 @main.command()
@@ -144,7 +214,7 @@ def uninstall(all, force, packages):
     errors = 0
     for package_spec in package_specs:
         p = PACKAGERS.resolved(package_spec)
-        if not force and not p.current.file_exists:
+        if not force and not p.current.stored:
             errors += 1
             LOG.error("%s was not installed with pickley", package_spec)
             continue
@@ -152,7 +222,11 @@ def uninstall(all, force, packages):
         eps = p.entry_points
         ep_uninstalled = 0
         ep_missed = 0
+        stored = p.current.stored
         meta_deleted = runez.delete(system.SETTINGS.meta.full_path(package_spec.dashed), fatal=False)
+        if stored and meta_deleted >= 0:
+            system.SETTINGS.state.delete(package_spec.dashed)
+            meta_deleted = 1
         if not eps and force:
             eps = {package_spec.dashed: ""}
         if eps and meta_deleted >= 0:
@@ -313,9 +387,14 @@ def auto_upgrade(force, package):
 
     runez.touch(ping)
 
+    previous = p.current.version
     try:
         p.internal_install()
 
     except SoftLockException:
         print("Skipping auto-upgrade, %s is currently being installed by another process" % package)
         sys.exit(0)
+
+    if p.current.version != previous:
+        # Already running in the background (started by wrapper), no need to defer cleanup
+        garbage.GarbageCollector(system.SETTINGS.gc_bytes).run()
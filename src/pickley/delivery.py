@@ -1,5 +1,10 @@
 import logging
+import mmap
 import os
+import shutil
+import stat
+import sys
+import tempfile
 
 import runez
 
@@ -7,15 +12,32 @@ from pickley import system
 from pickley.context import ImplementationMap
 from pickley.settings import short
 
+try:
+    import fcntl
+
+except ImportError:  # pragma: no cover, Windows
+    fcntl = None
+
+try:  # python3
+    from os import scandir
+
+except ImportError:  # pragma: no cover, python2
+    from scandir import scandir
+
 LOG = logging.getLogger(__name__)
 DELIVERERS = ImplementationMap("delivery")
+NON_VENV_FOLDERS = {".git", ".hg", ".svn", "__pycache__", "node_modules", "site-packages"}  # Not worth looking for venvs in these
+RELOCATION_JOBS = 8
+
+# ioctl() allowing to clone files on copy-on-write file systems (btrfs, xfs, ...)
+FICLONE = 0x40049409 if fcntl is not None and sys.platform.startswith("linux") else None
 
 GENERIC_WRAPPER = """
 #!/bin/bash
 
 %s
 
-if [[ -x {pickley} ]]; then
+if [[ -x {pickley} && -z `find {ping} -mmin -{delay} 2> /dev/null` ]]; then
     {hook}nohup {pickley} auto-upgrade {name}{bg}
 fi
 if [[ -x {source} ]]; then
@@ -36,7 +58,7 @@ PICKLEY_WRAPPER = """
 %s
 
 if [[ -x {source} ]]; then
-    if [[ "$*" != *"auto-upgrade"* ]]; then
+    if [[ "$*" != *"auto-upgrade"* && -z `find {ping} -mmin -{delay} 2> /dev/null` ]]; then
         {hook}nohup {source} auto-upgrade {name}{bg}
     fi
     {hook}exec {source} "$@"
@@ -111,6 +133,9 @@ class DeliveryMethodSymlink(DeliveryMethod):
 class DeliveryMethodWrap(DeliveryMethod):
     """
     Deliver via a small wrap that ensures target executable is up-to-date
+
+    The wrapper itself checks the age of the .ping file (touched by auto-upgrade),
+    so that pickley is started only when a version check is due (every 'version_check_delay' minutes)
     """
 
     # Can be set in tests to make wrapper a no-op
@@ -123,6 +148,8 @@ class DeliveryMethodWrap(DeliveryMethod):
             hook=self.hook,
             bg=self.bg,
             name=runez.quoted(self.package_spec.dashed, adapter=None),
+            ping=runez.quoted(system.SETTINGS.meta.full_path(self.package_spec.dashed, ".ping"), adapter=None),
+            delay=max(1, system.SETTINGS.version_check_seconds // 60),
             pickley=runez.quoted(system.SETTINGS.base.full_path(system.PICKLEY), adapter=None),
             source=runez.quoted(source, adapter=None),
         )
@@ -137,20 +164,138 @@ class DeliveryMethodCopy(DeliveryMethod):
     """
 
     def _install(self, target, source):
-        copy_venv(source, target)
+        # Installed packages are never modified in place, their files can be shared via hardlinks
+        copy_venv(source, target, hardlink=True)
 
 
-def copy_venv(source, destination, fatal=True, logger=LOG.debug):
+def copy_venv(source, destination, fatal=True, logger=LOG.debug, hardlink=False):
     """
-    Copy source -> destination
+    Copy source -> destination, files are cloned via reflinks when supported by file system
 
     :param str source: Source file or folder
     :param str destination: Destination file or folder
     :param bool fatal: Abort execution on failure if True
     :param callable|None logger: Logger to use
+    :param bool hardlink: If True, files that can't be reflinked are hardlinked (when on same file system)
     :return int: 1 if effectively done, 0 if no-op, -1 on failure
     """
-    return runez.copy(source, destination, adapter=_relocator, fatal=fatal, logger=logger)
+    if not source or not destination or source == destination:
+        return 0
+
+    if runez.DRYRUN:
+        LOG.debug("Would copy %s -> %s", short(source), short(destination))
+        return 1
+
+    if not os.path.exists(source):
+        return runez.abort("%s does not exist, can't copy to %s", short(source), short(destination), fatal=(fatal, -1))
+
+    try:
+        runez.ensure_folder(destination, fatal=fatal, logger=None)
+        clone_tree(source, destination, hardlink=hardlink)
+        relocated = relocate_venv(destination, source, destination, fatal=fatal)
+        if relocated < 0:
+            # Scripts in 'destination' would otherwise still act on 'source'
+            return runez.abort("Can't relocate %s", short(destination), fatal=(fatal, -1))
+
+        if logger:
+            logger("Copied %s -> %s%s", short(source), short(destination), _relocation_note(relocated))
+
+        return 1
+
+    except Exception as e:
+        return runez.abort("Can't copy %s -> %s: %s", short(source), short(destination), e, fatal=(fatal, -1))
+
+
+def clone_tree(source, destination, hardlink=False):
+    """
+    :param str source: Source file or folder
+    :param str destination: Destination file or folder (existing folders are merged into)
+    :param bool hardlink: If True, allow files to be hardlinked
+    """
+    if os.path.islink(source):
+        if os.path.lexists(destination):
+            os.unlink(destination)
+
+        os.symlink(os.readlink(source), destination)
+        return
+
+    if not os.path.isdir(source):
+        clone_file(source, destination, hardlink=hardlink)
+        return
+
+    if not os.path.isdir(destination):
+        if os.path.lexists(destination):
+            os.unlink(destination)
+
+        os.mkdir(destination)
+
+    for entry in _scandir(source):
+        clone_tree(entry.path, os.path.join(destination, entry.name), hardlink=hardlink)
+
+    shutil.copystat(source, destination)
+
+
+def clone_file(source, destination, hardlink=False):
+    """
+    Clone file using cheapest method supported: reflink, hardlink (if allowed), copy_file_range() or regular copy
+
+    :param str source: Source file
+    :param str destination: Destination file
+    :param bool hardlink: If True, allow 'destination' to be a hardlink to 'source'
+    :return str: Method used
+    """
+    if os.path.lexists(destination):
+        os.unlink(destination)
+
+    mode = stat.S_IMODE(os.stat(source).st_mode)
+    with open(source, "rb") as fsrc:
+        if FICLONE:
+            fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+            try:
+                fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+                os.close(fd)
+                shutil.copystat(source, destination)
+                return "reflink"
+
+            except (IOError, OSError):
+                os.close(fd)
+                os.unlink(destination)
+
+        if hardlink:
+            try:
+                os.link(source, destination)
+                return "hardlink"
+
+            except OSError:
+                pass  # Not on same file system, or hardlinks not supported
+
+        with open(destination, "wb") as fdst:
+            method = "copy"
+            if hasattr(os, "copy_file_range"):
+                try:
+                    size = os.fstat(fsrc.fileno()).st_size
+                    copied = 0
+                    while copied < size:
+                        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                        if not n:
+                            break
+
+                        copied += n
+
+                    if copied >= size:
+                        method = "copy_file_range"
+
+                except OSError:
+                    pass  # Not supported by kernel or file system, fallback to regular copy
+
+            if method == "copy":
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+                shutil.copyfileobj(fsrc, fdst)
+
+    shutil.copystat(source, destination)
+    return method
 
 
 def move_venv(source, destination, fatal=True, logger=LOG.debug):
@@ -168,13 +313,20 @@ def move_venv(source, destination, fatal=True, logger=LOG.debug):
 
 def _relocator(source, destination, fatal=True, logger=None):
     """Adapter for move/copy file"""
-    relocated = relocate_venv(source, source, destination, fatal=fatal)
+    return _relocation_note(relocate_venv(source, source, destination, fatal=fatal))
+
+
+def _relocation_note(relocated):
+    """
+    :param int relocated: Number of relocated files (-1 on failure)
+    :return str: Note to add to log message
+    """
     if relocated < 0:
         return " (relocation failed)"
     return " (relocated %s)" % relocated if relocated else ""
 
 
-def relocate_venv(path, source, destination, fatal=True, _seen=None):
+def relocate_venv(path, source, destination, fatal=True):
     """
     :param str path: Path of file or folder to relocate (change mentions of 'source' to 'destination')
     :param str source: Where venv used to be
@@ -182,44 +334,87 @@ def relocate_venv(path, source, destination, fatal=True, _seen=None):
     :param bool fatal: Abort execution on failure if True
     :return int: Number of relocated files (0 if no-op, -1 on failure)
     """
-    original_call = False
-    if _seen is None:
-        original_call = True
-        _seen = set()
-
-    if not path or path in _seen:
+    if not path:
         return 0
 
-    _seen.add(path)
     if os.path.isdir(path):
-        relocated = 0
-        if original_call:
-            for bin_folder in find_venvs(path):
-                for name in os.listdir(bin_folder):
-                    fpath = os.path.join(bin_folder, name)
-                    r = relocate_venv(fpath, source, destination, fatal=fatal, _seen=_seen)
-                    if r < 0:
-                        return r
-                    relocated += r
-        return relocated
-
-    modified = False
-    lines = []
+        files = list(venv_scripts(path))
+
+    else:
+        files = [path]
+
+    source = runez.stringified(source).encode("utf-8")
+    destination = runez.stringified(destination).encode("utf-8")
+    jobs = RELOCATION_JOBS if len(files) > 2 * RELOCATION_JOBS else 1
+    relocated = 0
+    for r in system.concurrently(lambda x: relocate_file(x, source, destination, fatal=fatal), files, jobs=jobs):
+        if r < 0:
+            return r
+
+        relocated += r
+
+    return relocated
+
+
+def relocate_file(path, source, destination, fatal=True):
+    """
+    :param str path: Path of file to relocate
+    :param bytes source: Where venv used to be
+    :param bytes destination: Where venv is moved to
+    :param bool fatal: Abort execution on failure if True
+    :return int: 1 if file was relocated, 0 if no-op, -1 on failure
+    """
     try:
-        for line in runez.readlines(path):
-            if source in line:
-                line = line.replace(source, destination)
-                modified = True
+        with open(path, "rb") as fh:
+            if b"\0" in fh.read(1024):
+                return 0  # Binary file, skip
 
-            lines.append(line)
+            size = os.fstat(fh.fileno()).st_size
+            if size < len(source):
+                return 0
 
-    except Exception:
-        return 0  # If binary file, skip
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if mm.find(source) < 0:
+                    return 0
 
-    if not modified:
-        return 0
+                content = mm[:]
+
+            finally:
+                mm.close()
+
+        if runez.DRYRUN:
+            LOG.debug("Would relocate %s", short(path))
+            return 1
+
+        # Write to a temp file, then rename: a concurrent reader never sees a partially relocated file
+        fd, temp = tempfile.mkstemp(prefix=".%s." % os.path.basename(path), dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content.replace(source, destination))
+
+            os.chmod(temp, stat.S_IMODE(os.stat(path).st_mode))
+            os.rename(temp, path)
+
+        except Exception:
+            runez.delete(temp, fatal=False, logger=None)
+            raise
+
+        return 1
+
+    except (IOError, OSError, ValueError) as e:
+        return runez.abort("Can't relocate %s: %s", short(path), e, fatal=(fatal, -1))
 
-    return runez.write(path, "\n".join(lines), fatal=fatal)
+
+def venv_scripts(folder):
+    """
+    :param str folder: Folder to scan for venvs
+    :return: Regular files in bin/ folders of venvs found under 'folder'
+    """
+    for bin_folder in find_venvs(folder):
+        for entry in _scandir(bin_folder):
+            if entry.is_file(follow_symlinks=False):
+                yield entry.path
 
 
 def find_venvs(folder, _seen=None):
@@ -231,15 +426,36 @@ def find_venvs(folder, _seen=None):
         if _seen is None:
             folder = os.path.realpath(folder)
             _seen = set()
-        if folder not in _seen:
-            _seen.add(folder)
-            files = os.listdir(folder)
-            if "bin" in files:
-                bin_folder = os.path.join(folder, "bin")
-                if runez.is_executable(os.path.join(bin_folder, "python")):
-                    yield bin_folder
-                    return
-            for name in files:
-                fname = os.path.join(folder, name)
-                for path in find_venvs(fname, _seen=_seen):
-                    yield path
+
+        try:
+            st = os.stat(folder)
+
+        except OSError:
+            return
+
+        key = (st.st_dev, st.st_ino)
+        if key in _seen:
+            return
+
+        _seen.add(key)
+        entries = [e for e in _scandir(folder) if e.name not in NON_VENV_FOLDERS and e.is_dir()]
+        for entry in entries:
+            if entry.name == "bin" and runez.is_executable(os.path.join(entry.path, "python")):
+                yield entry.path
+                return  # Don't look for venvs within venvs
+
+        for entry in entries:
+            for path in find_venvs(entry.path, _seen=_seen):
+                yield path
+
+
+def _scandir(folder):
+    """
+    :param str folder: Folder to scan
+    :return list: Entries of 'folder' (empty list if folder can't be read)
+    """
+    try:
+        return list(scandir(folder))
+
+    except OSError:
+        return []
@@ -0,0 +1,230 @@
+"""
+Garbage collection of older installs, run via 'pickley gc'
+
+Installs don't wait for cleanup: once delivery is complete, 'pickley gc' is started in the background.
+- older installs of each package are deleted after 'install_timeout' minutes (see Packager.cleanup())
+- tool venvs not used for TOOL_KEEP_DAYS days are deleted (as well as shared tool venvs of older pickley versions)
+- if 'gc_budget' is configured, least recently used older installs and tool venvs are deleted
+  until all installs and tool venvs fit in that budget (installs currently in use are never deleted,
+  the most recent install of each group is kept for packages installed by older pickley versions)
+"""
+
+import logging
+import os
+import re
+import subprocess
+
+import runez
+
+from pickley import system
+from pickley.lock import SoftLock, SoftLockException, ToolVenv
+from pickley.package import PACKAGERS
+
+try:  # python3
+    from os import scandir
+
+except ImportError:  # pragma: no cover, python2
+    from scandir import scandir
+
+LOG = logging.getLogger(__name__)
+LEGACY_VENV = re.compile(r"^_py\d*(\.lock)?$")  # Shared tool venvs (and their lock) of older pickley versions, example: _py37
+
+
+def disk_usage(path):
+    """
+    :param str path: Path to file or folder
+    :return int: Size in bytes of 'path' (symlinks are not followed)
+    """
+    try:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_size
+
+        total = 0
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                total += disk_usage(entry.path)
+
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+
+        return total
+
+    except OSError:
+        return 0  # Deleted concurrently
+
+
+def tool_roots():
+    """
+    :return list: Folders holding cached tool venvs, one per python
+    """
+    folder = system.SETTINGS.venvs.full_path("_tools")
+    if not os.path.isdir(folder):
+        return []
+
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if not name.startswith(".")]
+
+
+def legacy_venvs():
+    """
+    :return list: Shared tool venvs left behind by older pickley versions (replaced by one venv per tool, see ToolVenv)
+    """
+    folder = system.SETTINGS.venvs.path
+    if not os.path.isdir(folder):
+        return []
+
+    names = set(name.replace(".lock", "") for name in os.listdir(folder) if LEGACY_VENV.match(name))
+    return [os.path.join(folder, name) for name in sorted(names)]
+
+
+class GarbageCollector(object):
+    """Cleanup of older installs and tool venvs, for all packages installed in <base>"""
+
+    def __init__(self, budget=None):
+        """
+        :param int|None budget: Optional size (in bytes) that installs and tool venvs should not exceed
+        """
+        self.budget = budget
+        self.deleted = 0  # Number of deleted older installs
+        self.evicted = 0  # Number of deleted tool venvs
+
+    def __repr__(self):
+        return "deleted %s older installs and %s tool venvs" % (self.deleted, self.evicted)
+
+    def run(self):
+        """
+        :return bool: True if collection was performed, False if another 'pickley gc' is already running
+        """
+        try:
+            with SoftLock(system.SETTINGS.meta.full_path(".gc"), timeout=0):
+                self.collect()
+                return True
+
+        except SoftLockException:
+            LOG.debug("Garbage collection is already running in another process")
+            return False
+
+    def collect(self):
+        """Should be called while holding the .gc soft lock"""
+        packagers = []
+        for package_spec in system.resolved_package_specs(None, auto_complete=True):
+            p = PACKAGERS.resolved(package_spec)
+            packagers.append(p)
+            try:
+                with SoftLock(p.dist_folder, timeout=0):
+                    self.deleted += p.cleanup()
+
+            except SoftLockException:
+                LOG.debug("Not cleaning up %s, it is currently being installed", package_spec)
+
+        for folder in legacy_venvs():
+            exists = os.path.isdir(folder)
+            try:
+                with SoftLock(folder, timeout=0):
+                    pass  # Folder is deleted once lock is acquired (as it's not kept), its .lock file when lock is released
+
+                if exists:
+                    self.evicted += 1
+
+            except SoftLockException:
+                LOG.debug("Not deleting %s, it is in use by an older pickley", runez.short(folder))
+
+        for root in tool_roots():
+            before = len(ToolVenv.entries(root))
+            ToolVenv.evict(root)
+            self.evicted += before - len(ToolVenv.entries(root))
+
+        if self.budget:
+            self.enforce_budget(packagers)
+
+    def enforce_budget(self, packagers):
+        """
+        :param list packagers: Packagers of all installed packages
+        """
+        total = 0
+        candidates = []  # (last used, size, path, tool venv or packager of install)
+        for p in packagers:
+            folder = system.SETTINGS.meta.full_path(p.package_spec.dashed)
+            if not os.path.isdir(folder):
+                continue
+
+            installs = system.SETTINGS.state.get(p.package_spec.dashed, "installs", default={})
+            current = installs.get("current")  # Not known for installs done by older pickley versions
+            known = installs.get("groups") or {}  # Installs not in prefix index yet are kept (package being installed right now)
+            groups = {}
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                size = disk_usage(path)
+                total += size
+                if not name.startswith(".") and name in known:
+                    groups.setdefault(known[name], []).append((os.path.getmtime(path), size, path))
+
+            for group in groups.values():
+                superseded = None  # Older installs were last used when the next one of their group was installed
+                for mtime, size, path in sorted(group, reverse=True):
+                    if current is None:
+                        if superseded is not None:
+                            candidates.append((superseded, size, path, p))
+
+                    elif os.path.basename(path) not in current:
+                        candidates.append((superseded or mtime, size, path, p))
+
+                    superseded = mtime
+
+        for root in tool_roots():
+            for venv in ToolVenv.entries(root):
+                size = disk_usage(venv.folder)
+                total += size
+                candidates.append((venv.last_used, size, venv.folder, venv))
+
+        for _, size, path, owner in sorted(candidates, key=lambda x: x[0]):
+            if total <= self.budget:
+                break
+
+            if isinstance(owner, ToolVenv):
+                owner.evict_if_unused()
+                if os.path.exists(owner.folder):
+                    continue  # In use by another process
+
+                self.evicted += 1
+
+            else:
+                try:
+                    # Same lock as installs: an install can reuse an existing folder (reinstall, downgrade)
+                    with SoftLock(owner.dist_folder, timeout=0):
+                        if runez.delete(path, fatal=False) <= 0:
+                            continue
+
+                except SoftLockException:
+                    LOG.debug("Not deleting %s, %s is currently being installed", runez.short(path), owner.package_spec)
+                    continue
+
+                self.deleted += 1
+
+            total -= size
+
+        if total > self.budget:
+            LOG.warning("%s still uses %s, over budget of %s", runez.short(system.SETTINGS.meta.path), total, self.budget)
+
+
+def schedule():
+    """Run garbage collection in the background, via installed pickley if available (or right away otherwise)"""
+    pickley = system.SETTINGS.base.full_path(system.PICKLEY)
+    if not runez.DRYRUN and runez.is_executable(pickley):
+        args = [pickley, "--base", system.SETTINGS.base.path]
+        if system.SETTINGS.config:
+            args.extend(["--config", system.SETTINGS.config])
+
+        args.append("gc")
+        try:
+            with open(os.devnull, "w") as devnull:
+                # Detached from our session, so that it keeps running after we exit
+                setsid = getattr(os, "setsid", None)
+                subprocess.Popen(args, stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=setsid)
+
+            LOG.debug("Started garbage collection in the background")
+            return
+
+        except OSError as e:
+            LOG.debug("Can't start garbage collection in the background: %s", e)
+
+    GarbageCollector(system.SETTINGS.gc_bytes).run()
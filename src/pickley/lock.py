@@ -1,13 +1,25 @@
+import errno
+import glob
 import logging
 import os
+import threading
 import time
 
 import runez
 
 from pickley import system
+from pickley.delivery import move_venv
+from pickley.pypi import install_index, pip_index_args
+
+try:
+    import fcntl
+
+except ImportError:  # pragma: no cover, Windows
+    fcntl = None
 
 
 LOG = logging.getLogger(__name__)
+TOOL_KEEP_DAYS = 10  # Tool venvs not used for this many days get evicted
 
 
 class SoftLockException(Exception):
@@ -23,11 +35,13 @@ class SoftLock(object):
 
     Several pickley processes could be attempting to auto upgrade a package at the same time
     With this class, we provide a soft lock mechanism on folders:
-    - first process "grabs a lock" (lock based on existence of file, and its age)
-    - lock consists of creating a <folder>.lock file, pid of process that created the file is stored there
-    - a timeout of > 0 can be used to wait for lock acquisition
+    - first process "grabs a lock" (kernel lock via flock() on a <folder>.lock file, when available)
+    - pid of process that holds the lock is stored in <folder>.lock (for diagnostics)
+    - a timeout of > 0 can be used to wait for lock acquisition (waiters are woken up as soon as lock is released)
     - a timeut of 0 will make it so that calling process fails to obtain lock immediately (via SoftLockException)
-    - a lock can be held only for the given 'invalid' time (allows to not get blocked by a crashed left-over)
+    - kernel lock is released automatically if process holding it dies
+    - without flock() (or in dryrun mode): lock based on existence of file, and its age,
+      a lock can be held only for the given 'invalid' time (allows to not get blocked by a crashed left-over)
     - the created folder is kept around for 'keep' days (if > 0)
     """
 
@@ -43,6 +57,7 @@ class SoftLock(object):
         self.timeout = timeout * 60
         self.invalid = invalid * 60
         self.keep = keep * 60 * 60 * 24
+        self._fd = None  # File descriptor holding kernel lock, if any
 
     def __repr__(self):
         return self.lock
@@ -51,6 +66,9 @@ class SoftLock(object):
         """
         :return bool: True if lock is held by another process
         """
+        if fcntl is not None and not runez.DRYRUN:
+            return is_flocked(self.lock)
+
         if not runez.file.is_younger(self.lock, self.invalid):
             # Lock file does not exist or invalidation age reached
             return False
@@ -67,14 +85,25 @@ class SoftLock(object):
         """
         Acquire lock
         """
-        cutoff = time.time() + self.timeout
-        while self._locked():
-            if time.time() >= cutoff:
+        if fcntl is not None and not runez.DRYRUN:
+            runez.ensure_folder(self.lock, logger=None)
+            self._fd = flocked(self.lock, self.timeout)
+            if self._fd is None:
                 raise SoftLockException(self.folder)
-            time.sleep(1)
 
-        # We got the soft lock
-        runez.write(self.lock, "%s\n" % os.getpid())
+            # We got the lock, state our pid in lock file
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, ("%s\n" % os.getpid()).encode("ascii"))
+
+        else:
+            cutoff = time.time() + self.timeout
+            while self._locked():
+                if time.time() >= cutoff:
+                    raise SoftLockException(self.folder)
+                time.sleep(1)
+
+            # We got the soft lock
+            runez.write(self.lock, "%s\n" % os.getpid())
 
         if not self._should_keep():
             runez.delete(self.folder, logger=LOG.debug if self.keep else None)
@@ -88,23 +117,139 @@ class SoftLock(object):
         if not self._should_keep():
             runez.delete(self.folder, logger=LOG.debug if self.keep else None)
         runez.delete(self.lock)
+        if self._fd is not None:
+            # Closing the file releases the kernel lock
+            os.close(self._fd)
+            self._fd = None
+
+
+def is_flocked(path):
+    """
+    :param str path: Path to lock file
+    :return bool: True if an exclusive flock() is currently held on 'path'
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+
+    except (IOError, OSError):
+        return False
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return False
+
+    except (IOError, OSError):
+        return True
+
+    finally:
+        os.close(fd)
+
+
+def flocked(path, timeout):
+    """
+    :param str path: Path to lock file (created if needed)
+    :param int|float timeout: Max number of seconds to wait for lock
+    :return int|None: File descriptor holding an exclusive flock() on 'path', None if lock couldn't be acquired within 'timeout'
+    """
+    cutoff = time.time() + timeout
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not _wait_for_flock(fd, cutoff - time.time()):
+            os.close(fd)
+            return None
+
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+
+        except (IOError, OSError):
+            pass
+
+        # Previous holder deleted lock file right before releasing it, lock the new one instead
+        os.close(fd)
+
+
+def _wait_for_flock(fd, timeout):
+    """
+    :param int fd: File descriptor to lock
+    :param int|float timeout: Max number of seconds to wait for lock
+    :return bool: True if lock was acquired
+    """
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+
+    if timeout <= 0:
+        return False
+
+    # Blocking flock() can't be interrupted, wait in a helper thread working on its own copy of 'fd'
+    waiter_fd = os.dup(fd)
+    acquired = threading.Event()
+    mutex = threading.Lock()
+    state = {"abandoned": False, "failed": False}
+
+    def wait():
+        try:
+            fcntl.flock(waiter_fd, fcntl.LOCK_EX)
+
+        except (IOError, OSError):  # pragma: no cover
+            state["failed"] = True
+
+        with mutex:
+            if state["abandoned"]:
+                # Caller gave up and closed 'fd': closing last reference releases lock (if we got it)
+                os.close(waiter_fd)
+
+            else:
+                acquired.set()
+
+    thread = threading.Thread(target=wait)
+    thread.daemon = True
+    thread.start()
+    acquired.wait(timeout)
+    with mutex:
+        if acquired.is_set():
+            os.close(waiter_fd)
+            return not state["failed"]
+
+        state["abandoned"] = True
+        return False
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+
+    except OSError:
+        return 0
 
 
 def vrun(package_spec, command, *args, **kwargs):
     """
-    Run command + args from an on-the-fly create virtualenv, for associated pypi 'package_spec'.
+    Run command + args from a cached tool venv, for associated pypi 'package_spec'.
     This allows us to run commands like 'pex ...' with pex installed when/if needed
 
     :param system.PackageSpec package_spec: Associated pypi package the run is for
-    :param str command: Command to run (pip, pex, etc...)
+    :param str command: Command to run (pip, pex, etc...), optionally specced with a version (example: pex==1.6)
     :param args: Command line args
     :param kwargs: Optional named args to pass-through to runez.run()
     """
     python = system.target_python(package_spec=package_spec)
-    folder = system.SETTINGS.venvs.full_path("_%s" % python.short_name)
-    with SoftLock(folder, timeout=system.SETTINGS.install_timeout, invalid=system.SETTINGS.install_timeout, keep=10) as lock:
-        shared = SharedVenv(lock, python)
-        return shared._run_from_venv(command, *args, **kwargs)
+    spec = system.PackageSpec(command)
+    if spec.dashed == "venv":
+        # Use original python installation when using the builtin venv module
+        return runez.run(python.executable, "-mvenv", *args, **kwargs)
+
+    with ToolVenv.get(python, spec) as venv:
+        # Tool venv is only read-locked here: any number of builds can run concurrently
+        if spec.dashed == "pip":
+            return venv.run_module("pip", *args, **kwargs)
+
+        return runez.run(venv.program(spec.dashed), *args, **kwargs)
 
 
 def virtualenv_path():
@@ -118,92 +263,268 @@ def virtualenv_path():
     return path
 
 
-class SharedVenv(object):
-    def __init__(self, lock, venv_python):
+class ToolVenv(object):
+    """
+    Venv with a given version of a tool (pex, virtualenv, ...) installed, used via vrun()
+
+    Entries live in <base>/.pickley/_venvs/_tools/<python>/<tool>-<version>/
+    - they're built once (in a scratch folder, under a SoftLock), then moved to their final location
+    - once built, an entry is never modified: any number of pickley processes can use it concurrently
+    - frozen.json is written last, and marks the entry as complete
+    - entries in use are held via a shared flock() on their frozen.json (when available)
+    - entries not used for TOOL_KEEP_DAYS days are evicted (unless they're in use)
+    """
+
+    def __init__(self, folder):
         """
-        :param SoftLock lock: Acquired lock
+        :param str folder: Folder where venv resides
         """
-        self.venv_python = venv_python
-        self.lock = lock
-        self.folder = lock.folder
-        self.bin = os.path.join(self.folder, "bin")
+        self.folder = folder
+        self.bin = os.path.join(folder, "bin")
         self.python = os.path.join(self.bin, "python")
-        self._frozen = None
-        if runez.file.is_younger(self.python, self.lock.keep):
-            return
-        runez.delete(self.folder)
+        self._fd = None  # File descriptor holding shared lock on this entry, while in use
 
-        is_py2 = runez.PY2
-        if venv_python:
-            is_py2 = runez.to_int(venv_python.major, default=2) < 3
+    def __repr__(self):
+        return runez.short(self.folder)
 
-        if is_py2:
-            venv = virtualenv_path()
-            if not venv:
-                runez.abort("Can't determine path to virtualenv.py")
-            runez.run(self.venv_python.executable, venv, self.folder)
+    def __enter__(self):
+        return self
 
-        else:
-            runez.run(self.venv_python.executable, "-mvenv", self.folder)
-            runez.run(self.python, "-mpip", "install", "wheel")
+    def __exit__(self, *_):
+        self.release()
 
     @property
     def frozen_path(self):
         return os.path.join(self.folder, "frozen.json")
 
     @property
-    def frozen(self):
-        if self._frozen is None:
-            self._frozen = runez.read_json(self.frozen_path, default={})
-        return self._frozen or {}
-
-    def _run_builtin_module(self, mod, *args, **kwargs):
-        args = runez.flattened(args, shellify=True)
-        python = self.python
-        if mod == "venv":
-            # Use original python installation when using the builtin venv module
-            python = self.venv_python.executable
-
-        return runez.run(python, "-m%s" % mod, *args, **kwargs)
-
-    def _refresh_frozen(self):
-        result = self._run_builtin_module("pip", "freeze", "--all", fatal=False)
-        self._frozen = {}
-        if result.output:
-            for line in result.output.split("\n"):
-                name, version = system.despecced(line)
-                self._frozen[name] = version
-
-        if self._frozen:
-            runez.save_json(self._frozen, self.frozen_path)
-
-    def _installed_module(self, command_spec):
-        """
-        :param system.PackageSpec command_spec: Associated package spec
-        """
-        program = os.path.join(self.bin, command_spec.dashed)
-        current = self.frozen.get(command_spec.dashed)
-        if not current and runez.is_executable(program):
-            # Edge case for older versions that weren't based on freeze
-            self._refresh_frozen()
-            current = self.frozen.get(command_spec.dashed)
-        if not current or (command_spec.version and current != command_spec.version):
-            self._run_builtin_module("pip", "install", "-i", system.SETTINGS.index, command_spec.specced)
-            self._refresh_frozen()
-        return program
-
-    def _run_from_venv(self, command, *args, **kwargs):
-        """
-        Should be called while holding the soft file lock in context only
-
-        :param str command: Command to run from that package (optionally specced with version)
-        :param args: Args to invoke program with
-        :param kwargs: Additional args
-        """
-        cmd = system.PackageSpec(command)
-        if cmd.dashed in ("pip", "venv"):
-            return self._run_builtin_module(cmd.dashed, *args, **kwargs)
-
-        args = runez.flattened(args, shellify=True)
-        full_path = self._installed_module(cmd)
-        return runez.run(full_path, *args, **kwargs)
+    def site_packages(self):
+        """
+        :return str|None: Path to site-packages folder of this venv
+        """
+        for path in glob.glob(os.path.join(self.folder, "lib", "python*", "site-packages")):
+            return path
+
+    def scanned_frozen(self):
+        """
+        Equivalent of 'pip freeze --all', without the cost of running pip
+
+        :return dict: Versions of packages installed in this venv, as found in their *.dist-info metadata, keyed by dashed name
+        """
+        result = {}
+        site_packages = self.site_packages
+        if site_packages:
+            for pattern in ("*.dist-info/METADATA", "*.egg-info/PKG-INFO"):
+                for path in glob.glob(os.path.join(site_packages, pattern)):
+                    name = version = None
+                    for line in runez.readlines(path, errors="ignore", fatal=False):
+                        if not line:
+                            break  # Headers end at first empty line
+
+                        if line.startswith("Name:"):
+                            name = line[5:].strip()
+
+                        elif line.startswith("Version:"):
+                            version = line[8:].strip()
+
+                    if name and version:
+                        result[system.PackageSpec(name).dashed] = version
+
+        return result
+
+    @property
+    def is_complete(self):
+        return os.path.isfile(self.frozen_path)
+
+    @property
+    def last_used(self):
+        return _mtime(self.folder)
+
+    def program(self, name):
+        """
+        :param str name: Name of program
+        :return str: Path to 'name' in this venv
+        """
+        return os.path.join(self.bin, name)
+
+    def run_module(self, mod, *args, **kwargs):
+        return runez.run(self.python, "-m%s" % mod, *args, **kwargs)
+
+    def hold(self):
+        """
+        Hold a shared lock on this entry, prevents its eviction by concurrent pickley processes while in use
+
+        :return bool: True if entry is still present (it could have been evicted in the meantime)
+        """
+        if fcntl is None or runez.DRYRUN:
+            return True
+
+        try:
+            self._fd = os.open(self.frozen_path, os.O_RDONLY)
+
+        except OSError:
+            return False
+
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        if os.fstat(self._fd).st_nlink:
+            return True
+
+        self.release()
+        return False
+
+    def release(self):
+        """Release shared lock, if held"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def touch(self):
+        """Mark this entry as recently used"""
+        if not runez.DRYRUN:
+            try:
+                os.utime(self.folder, None)
+
+            except OSError as e:  # pragma: no cover
+                LOG.debug("Can't touch %s: %s", self, e)
+
+    @classmethod
+    def get(cls, python, spec):
+        """
+        :param system.PythonInstallation python: Python installation to use
+        :param system.PackageSpec spec: Tool to get, unversioned spec means: most recently used version (if not too old)
+        :return ToolVenv: Venv with 'spec' installed, held via a shared lock (use as context manager, or call release())
+        """
+        root = system.SETTINGS.venvs.full_path("_tools", python.short_name)
+        for _ in range(3):
+            venv = cls.cached(root, spec)
+            built = venv is None
+            if built:
+                # Exclusive lock only while building
+                timeout = system.SETTINGS.install_timeout
+                with SoftLock(os.path.join(root, ".%s.build" % spec.dashed), timeout=timeout, invalid=timeout) as lock:
+                    venv = cls.cached(root, spec)  # Another process may have built it while we were waiting for the lock
+                    if venv is None:
+                        venv = cls.build(root, lock.folder, python, spec)
+
+            venv.touch()
+            if venv.hold():
+                if built:
+                    cls.evict(root)
+
+                return venv
+
+            LOG.debug("%s was evicted by another process, retrying", venv)
+
+        runez.abort("Can't get a venv with %s", spec)
+
+    @classmethod
+    def cached(cls, root, spec):
+        """
+        :param str root: Folder holding cached tool venvs
+        :param system.PackageSpec spec: Tool to look up
+        :return ToolVenv|None: Corresponding complete entry, if any
+        """
+        if spec.version:
+            venv = cls(os.path.join(root, "%s-%s" % (spec.dashed, spec.version)))
+            return venv if venv.is_complete else None
+
+        # Unversioned tools get refreshed with latest version every TOOL_KEEP_DAYS days
+        keep = TOOL_KEEP_DAYS * 24 * 60 * 60
+        candidates = []
+        for venv in cls.entries(root):
+            if spec.version_part(os.path.basename(venv.folder)) and runez.file.is_younger(venv.frozen_path, keep):
+                candidates.append(venv)
+
+        if candidates:
+            return max(candidates, key=lambda x: x.last_used)
+
+    @classmethod
+    def entries(cls, root):
+        """
+        :param str root: Folder holding cached tool venvs
+        :return list(ToolVenv): Complete entries
+        """
+        result = []
+        if os.path.isdir(root):
+            for name in os.listdir(root):
+                if not name.startswith("."):
+                    venv = cls(os.path.join(root, name))
+                    if venv.is_complete:
+                        result.append(venv)
+
+        return result
+
+    @classmethod
+    def build(cls, root, scratch, python, spec):
+        """
+        Should be called while holding the soft lock on 'scratch' only
+
+        :param str root: Folder holding cached tool venvs
+        :param str scratch: Temp folder where to build venv
+        :param system.PythonInstallation python: Python installation to use
+        :param system.PackageSpec spec: Tool to install
+        :return ToolVenv: Built venv
+        """
+        if python.has_builtin_venv:
+            runez.run(python.executable, "-mvenv", scratch)
+
+        else:
+            venv = virtualenv_path()
+            if not venv:
+                runez.abort("Can't determine path to virtualenv.py")
+            runez.run(python.executable, venv, scratch)
+
+        venv = cls(scratch)
+        venv.run_module("pip", "install", pip_index_args(install_index()), "wheel", spec.specced)
+        if runez.DRYRUN:
+            return venv
+
+        frozen = venv.scanned_frozen()
+        version = frozen.get(spec.dashed)
+        if not version:
+            runez.abort("Can't determine version of %s installed in %s", spec.dashed, runez.short(scratch))
+
+        venv = cls(os.path.join(root, "%s-%s" % (spec.dashed, version)))
+        if not venv.is_complete:
+            runez.delete(venv.folder)  # Possible left-over from an interrupted build
+            move_venv(scratch, venv.folder)
+            runez.save_json(frozen, venv.frozen_path)
+
+        return venv
+
+    @classmethod
+    def evict(cls, root):
+        """
+        :param str root: Folder holding cached tool venvs
+        """
+        keep = TOOL_KEEP_DAYS * 24 * 60 * 60
+        for venv in cls.entries(root):
+            if not runez.file.is_younger(venv.folder, keep):
+                venv.evict_if_unused()
+
+    def evict_if_unused(self):
+        """Delete this entry, unless another process is currently using it"""
+        if fcntl is None or runez.DRYRUN:
+            runez.delete(self.folder)
+            return
+
+        try:
+            fd = os.open(self.frozen_path, os.O_RDONLY)
+
+        except OSError:
+            return
+
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            except (IOError, OSError):
+                LOG.debug("Not evicting %s, it is in use", self)
+                return
+
+            # Remove completion marker first: concurrent users that opened it already will see it's gone
+            runez.delete(self.frozen_path, logger=None)
+            runez.delete(self.folder)
+
+        finally:
+            os.close(fd)
@@ -7,10 +7,11 @@ import runez
 
 import pickley
 from pickley import system
+from pickley.cache import VersionCache, WheelCache
 from pickley.context import ImplementationMap
-from pickley.delivery import DELIVERERS, move_venv
-from pickley.lock import SoftLock, SoftLockException, vrun
-from pickley.pypi import latest_pypi_version
+from pickley.delivery import copy_venv, DELIVERERS, move_venv, relocate_venv
+from pickley.lock import SoftLock, SoftLockException, ToolVenv, vrun
+from pickley.pypi import install_index, latest_pypi_version, pex_index_args, pip_index_args, same_version
 from pickley.settings import short
 from pickley.uninstall import uninstall_existing
 
@@ -25,6 +26,18 @@ C_COMPILATION_HELP = {
     "PKG_CONFIG_PATH": ":/usr/local/opt/openssl/lib/pkgconfig",
 }
 
+# Packages with several entry points get one shared pex, and a small launcher per entry point
+PEX_EXTENSION = ".pex"
+PEX_LAUNCHER = """
+#!/bin/sh
+
+export PEX_SCRIPT={name}
+exec {pex} "$@"
+"""
+
+# Distributions a fresh venv comes with, kept when upgrading a venv incrementally
+VENV_BOOTSTRAP = ("pip", "setuptools", "wheel")
+
 
 def find_prefix(prefixes, text):
     """
@@ -47,11 +60,10 @@ class VersionMeta(runez.Serializable):
     Version meta on a given package
     """
 
-    # Dields starting with '_' are not stored to json file
+    # Dields starting with '_' are not stored
     _base = None                    # type: VersionMeta # Base meta
-    _path = None                    # type: str # Path where this file stored
     _problem = None                 # type: str # Detected problem, if any
-    _suffix = None                  # type: str # Suffix of json file where this object is persisted
+    _suffix = None                  # type: str # Kind of state (current, latest) under which this object is persisted
     _package_spec = None            # type: system.PackageSpec # Associated pypi package
 
     # Main info, should be passed from latest -> current etc
@@ -68,38 +80,37 @@ class VersionMeta(runez.Serializable):
     pickley = ""                    # type: str # Pickley version used to perform install
     timestamp = None                # type: int # Epoch when version was determined (useful to cache "expensive" calls to pypi)
 
+    # Validators returned by pypi index, allow to cheaply re-check whether latest version changed
+    etag = ""                       # type: str # ETag header
+    last_modified = ""              # type: str # Last-Modified header
+    serial = ""                     # type: str # X-PyPI-Last-Serial header
+
+    # Failed version determinations are remembered as well, and retried with an exponential backoff
+    error = ""                      # type: str # Problem reported by last attempt, if it failed
+    failures = 0                    # type: int # Number of consecutive failed attempts
+
     def __init__(self, package_spec, suffix=None, base=None):
         """
         :param system.PackageSpec package_spec: Associated pypi package spec
-        :param str|None suffix: Optional suffix where to store this object
+        :param str|None suffix: Optional kind of state under which to store this object
         :param VersionMeta|None base: Base meta on which 'self' should be based
         """
         self._package_spec = package_spec
         self._suffix = suffix
         self._base = base
-        if suffix:
-            self._path = system.SETTINGS.meta.full_path(package_spec.dashed, ".%s.json" % suffix)
 
     def __repr__(self):
         return self.representation()
 
     def load(self):
-        path = self._path
-        old_path = None
-        if path is None and self._suffix == "current":  # pragma: no cover
-            if self._package_spec.multi_named and not os.path.exists(self._path):
-                # Temporary fix: pickley <v1.8 didn't standardize on dashed package name
-                p = system.SETTINGS.meta.full_path(self._package_spec.pythonified, ".%s.json" % self._suffix)
-                if os.path.exists(p):
-                    path = p
-                    old_path = self._path
-        data = runez.read_json(path, default={}, fatal=False)
-        self.set_from_dict(data, source=runez.short(path))
-        if old_path:  # pragma: no cover
-            self._path = old_path
+        data = system.SETTINGS.state.get(self._package_spec.dashed, self._suffix, default={})
+        if not isinstance(data, dict):
+            data = {}
+
+        self.set_from_dict(data, source="%s:%s" % (system.SETTINGS.state, self._suffix))
 
     def save(self):
-        runez.save_json(self.to_dict(), self._path, fatal=False)
+        system.SETTINGS.state.put(self._package_spec.dashed, self._suffix, self.to_dict())
 
     def _update_dynamic_fields(self):
         """Update dynamically determined fields"""
@@ -159,11 +170,11 @@ class VersionMeta(runez.Serializable):
         return bool(self.version) and not self._problem
 
     @property
-    def file_exists(self):
+    def stored(self):
         """
-        :return bool: True if corresponding json file exists
+        :return bool: True if this object was persisted in state store
         """
-        return self._path and os.path.exists(self._path)
+        return bool(self._suffix) and system.SETTINGS.state.get(self._package_spec.dashed, self._suffix) is not None
 
     def equivalent(self, other):
         """
@@ -172,7 +183,7 @@ class VersionMeta(runez.Serializable):
         """
         if other is None:
             return False
-        if self.version != other.version:
+        if not same_version(self.version, other.version):
             return False
         if self.packager != other.packager:
             return False
@@ -223,6 +234,29 @@ class VersionMeta(runez.Serializable):
         except (TypeError, ValueError):
             return False
 
+    @property
+    def still_failing(self):
+        """
+        :return bool: Is last failed version determination recent enough to not retry yet? (based on timestamp and backoff)
+        """
+        if not self.error or not self.timestamp:
+            return False
+        try:
+            delay = system.SETTINGS.error_check_seconds * 2 ** max(0, int(self.failures) - 1)
+            delay = min(delay, max(system.SETTINGS.error_check_seconds, system.SETTINGS.version_check_seconds))
+            return (int(time.time()) - self.timestamp) < delay
+        except (TypeError, ValueError):
+            return False
+
+    def record_failure(self, problem):
+        """
+        :param str problem: Description of problem, remembered until next retry
+        """
+        self.invalidate(problem)
+        self.error = problem
+        self.failures = runez.to_int(self.failures, default=0) + 1
+        self.save()
+
 
 class Packager(object):
     """
@@ -251,6 +285,7 @@ class Packager(object):
         self.relocatable = False
         self.source_folder = None
         self.packaged = []  # Paths to what was packaged (populated by self.effective_package())
+        self.installed = []  # Names of installs in meta folder (populated by self.effective_install())
         self.executables = []  # Paths to delivered exes (populated by perform_delivery())
 
     def __repr__(self):
@@ -265,12 +300,25 @@ class Packager(object):
         return self.implementation_name
 
     @property
-    def entry_points_path(self):
-        return system.SETTINGS.meta.full_path(self.package_spec.dashed, ".entry-points.json")
+    def download_dir(self):
+        """
+        :return str: Folder where last self.pip_wheel() run put what it downloaded (emptied before each run)
+        """
+        return os.path.join(self.build_folder, "downloads")
 
     @property
-    def removed_entry_points_path(self):
-        return system.SETTINGS.meta.full_path(self.package_spec.dashed, ".removed-entry-points.json")
+    def wheel_dir(self):
+        """
+        :return str: Folder where last self.pip_wheel() run put the wheels it produced (emptied before each run)
+        """
+        return os.path.join(self.build_folder, "wheelhouse")
+
+    @property
+    def removed_entry_points(self):
+        """
+        :return list: Entry points removed by an upgrade, not cleaned up yet
+        """
+        return system.SETTINGS.state.get(self.package_spec.dashed, "removed-entry-points", default=[])
 
     @property
     def entry_points(self):
@@ -278,7 +326,7 @@ class Packager(object):
         :return dict: Determined entry points from produced wheel, if available
         """
         if self._entry_points is None:
-            self._entry_points = runez.read_json(self.entry_points_path, fatal=None, default=None)
+            self._entry_points = system.SETTINGS.state.get(self.package_spec.dashed, "entry-points")
             if isinstance(self._entry_points, list):
                 # For backwards compatibility with pickley <= v1.4.2
                 self._entry_points = dict((k, "") for k in self._entry_points)
@@ -292,19 +340,19 @@ class Packager(object):
             return
         self._entry_points = self.get_entry_points()
         if self._entry_points:
-            runez.save_json(self._entry_points, self.entry_points_path, fatal=False)
+            system.SETTINGS.state.put(self.package_spec.dashed, "entry-points", self._entry_points)
 
     def get_entry_points(self):
         """
         :return dict|None: Determined entry points for associated pypi package
         """
-        if not os.path.isdir(self.build_folder):
+        if not os.path.isdir(self.wheel_dir):
             return None
 
         scripts = {}
-        for fname in os.listdir(self.build_folder):
+        for fname in os.listdir(self.wheel_dir):
             if fname.endswith(".whl") and self.package_spec.version_part(fname):
-                wheel_path = os.path.join(self.build_folder, fname)
+                wheel_path = os.path.join(self.wheel_dir, fname)
                 try:
                     with zipfile.ZipFile(wheel_path, "r") as wheel:
                         for wname in wheel.namelist():
@@ -328,20 +376,49 @@ class Packager(object):
     def refresh_latest(self, force=False):
         """Refresh self.latest"""
         self.latest.load()
-        if not force and self.latest.still_valid:
-            return
-
-        version = latest_pypi_version(system.SETTINGS.index, self.package_spec)
         source = system.SETTINGS.index or "pypi"
+        if not force and self.latest.source == source:
+            if self.latest.still_valid:
+                return
+
+            if self.latest.still_failing:
+                self.latest.invalidate(self.latest.error)
+                return
+
+        if self.latest.source != source:
+            # Validators are only meaningful for the index that provided them
+            self.latest.etag = self.latest.last_modified = self.latest.serial = ""
+            self.latest.failures = 0
+
+        shared = system.SETTINGS.version_cache and VersionCache(system.SETTINGS.version_cache)
+        if shared and not force:
+            data = shared.get(source, self.package_spec)
+            if data:
+                # Another pickley installation on this host already checked recently
+                self.latest.set_from_dict(data, source=runez.short(shared.path(source, self.package_spec)), merge=True)
+                self.latest.set_version_channel_source(self.latest.version, system.LATEST_CHANNEL, source)
+                self.latest.timestamp = data.get("timestamp")
+                self.latest.error = ""
+                self.latest.failures = 0
+                self.latest.save()
+                return
+
+        with system.throttled("network"):
+            version = latest_pypi_version(system.SETTINGS.indexes, self.package_spec, cached=self.latest)
+
         self.latest.set_version_channel_source(version, system.LATEST_CHANNEL, source)
         if not version:
-            self.latest.invalidate("can't determine latest version from %s" % source)
+            self.latest.record_failure("can't determine latest version from %s" % source)
 
-        elif not version.startswith("error: "):
-            self.latest.save()
+        elif version.startswith("error: "):
+            self.latest.record_failure(version[7:])
 
         else:
-            self.latest.invalidate(version[7:])
+            self.latest.error = ""
+            self.latest.failures = 0
+            self.latest.save()
+            if shared:
+                shared.put(source, self.package_spec, self.latest)
 
     def refresh_desired(self, force=False):
         """Refresh self.desired"""
@@ -366,21 +443,104 @@ class Packager(object):
 
         self.desired.invalidate("can't determine %s version" % channel)
 
+    @property
+    def wheel_cache(self):
+        """
+        :return WheelCache|None: Host-wide wheel cache, if configured
+        """
+        folder = system.SETTINGS.wheel_cache
+        if folder:
+            return WheelCache(folder, system.SETTINGS.wheel_cache_bytes)
+
+    def wheel_folders(self):
+        """
+        :return list: Folders where already built wheels can be found
+        """
+        result = [self.wheel_dir]
+        if system.SETTINGS.wheel_cache:
+            result.append(system.SETTINGS.wheel_cache)
+
+        return result
+
     def pip_wheel(self):
         """
-        Run pip wheel
+        Run pip wheel, in 2 phases: downloads (throttled as "network"), then builds of wheels from sdists (throttled as "cpu")
 
         :return str: None if successful, error message otherwise
         """
-        runez.ensure_folder(self.build_folder, folder=True)
-        return vrun(
-            self.package_spec,
-            "pip", "wheel", "-vv",
-            "-i", system.SETTINGS.index,
-            "--cache-dir", self.build_folder,
-            "--wheel-dir", self.build_folder,
-            self.source_folder if self.source_folder else "%s==%s" % (self.package_spec.dashed, self.desired.version)
-        )
+        # Start from empty folders: they then hold exactly what this run downloaded and produced
+        runez.delete(self.wheel_dir, logger=None)
+        runez.delete(self.download_dir, logger=None)
+        runez.ensure_folder(self.download_dir, folder=True)
+        wheel_cache = self.wheel_cache
+        index_args = pip_index_args(install_index())
+        find_links = ["--find-links", wheel_cache.folder] if wheel_cache else []
+        spec = self.source_folder if self.source_folder else "%s==%s" % (self.package_spec.dashed, self.desired.version)
+        with system.throttled("network"):
+            result = vrun(
+                self.package_spec,
+                "pip", "download",
+                index_args,
+                find_links,
+                "--cache-dir", self.build_folder,
+                "--dest", self.download_dir,
+                spec
+            )
+
+        downloaded = os.listdir(self.download_dir) if os.path.isdir(self.download_dir) else []
+        if not self.source_folder and all(fname.endswith(".whl") for fname in downloaded):
+            # Nothing to compile, downloaded wheels are what 'pip wheel' would produce
+            runez.move(self.download_dir, self.wheel_dir, logger=None)
+
+        else:
+            with system.throttled("cpu"):
+                result = vrun(
+                    self.package_spec,
+                    "pip", "wheel", "-vv",
+                    index_args,
+                    "--find-links", self.download_dir,
+                    find_links,
+                    "--cache-dir", self.build_folder,
+                    "--wheel-dir", self.wheel_dir,
+                    spec
+                )
+
+        if wheel_cache:
+            # Wheel of a local project is not identified by its version alone, it is not shared
+            exclude = self.package_spec.version_part if self.source_folder else None
+            wheel_cache.store(self.wheel_dir, exclude=exclude)
+
+        return result
+
+    def pinned_requirements(self):
+        """
+        :return list|None: Exact requirements ('name==version') of wheels produced by self.pip_wheel(), if unambiguous
+        """
+        if not os.path.isdir(self.wheel_dir):
+            return None
+
+        pinned = {}
+        for fname in os.listdir(self.wheel_dir):
+            if fname.endswith(".whl"):
+                parts = fname.split("-")
+                if len(parts) < 5:
+                    return None
+
+                name = system.PackageSpec(parts[0]).dashed
+                if pinned.get(name, parts[1]) != parts[1]:
+                    return None  # Several versions of same wheel, let pip resolve
+
+                pinned[name] = parts[1]
+
+        version = pinned.get(self.package_spec.dashed)
+        if version is None:
+            return None
+
+        if not same_version(version, self.desired.version):
+            msg = "'pip wheel' produced %s %s, expecting %s"
+            return runez.abort(msg, self.package_spec, version, self.desired.version, fatal=(True, None))
+
+        return ["%s==%s" % (name, version) for name, version in sorted(pinned.items())]
 
     def package(self):
         """Package given python project"""
@@ -404,7 +564,8 @@ class Packager(object):
         self.refresh_entry_points()
         self.packaged = []
         template = "{name}" if self.source_folder else "{name}-{version}"
-        self.effective_package(template)
+        with system.throttled("cpu"):
+            self.effective_package(template)
 
     def create_symlinks(self, symlink, root=None, fatal=True):
         """
@@ -456,9 +617,10 @@ class Packager(object):
     def install(self, force=False):
         """
         :param bool force: If True, re-install even if package is already installed
+        :return bool: True if package was (re)installed, False if it was already installed
         """
         try:
-            self.internal_install(force=force)
+            return self.internal_install(force=force)
 
         except SoftLockException as e:
             LOG.error("%s is currently being installed by another process" % self.package_spec)
@@ -468,6 +630,7 @@ class Packager(object):
         """
         :param bool force: If True, re-install even if package is already installed
         :param bool verbose: If True, show more extensive info
+        :return bool: True if package was (re)installed, False if it was already installed
         """
         with SoftLock(self.dist_folder, timeout=system.SETTINGS.install_timeout):
             self.refresh_desired(force=force)
@@ -477,8 +640,7 @@ class Packager(object):
 
             if not force and self.current.equivalent(self.desired):
                 system.inform(self.desired.representation(verbose=verbose, note="is already installed"))
-                self.cleanup()
-                return
+                return False
 
             system.setup_audit_log()
             prev_entry_points = self.entry_points
@@ -487,15 +649,15 @@ class Packager(object):
             new_entry_points = self.entry_points
             removed = set(prev_entry_points).difference(new_entry_points)
             if removed:
-                old_removed = runez.read_json(self.removed_entry_points_path, default=[], fatal=False)
-                removed = sorted(removed.union(old_removed))
-                runez.save_json(removed, self.removed_entry_points_path, fatal=False)
+                removed = sorted(removed.union(self.removed_entry_points))
+                system.SETTINGS.state.put(self.package_spec.dashed, "removed-entry-points", removed)
 
             # Delete wrapper/symlinks of removed entry points immediately
             for name in removed:
                 runez.delete(system.SETTINGS.base.full_path(name))
 
-            self.cleanup()
+            # Older installs are cleaned up later, outside of install critical path (see pickley.garbage)
+            self.record_installs()
             if self.package_spec.multi_named:
                 # Clean up old installations with underscore in name
                 runez.delete(system.SETTINGS.meta.full_path(self.package_spec.pythonified))
@@ -508,13 +670,21 @@ class Packager(object):
 
             msg = "Would install" if runez.DRYRUN else "Installed"
             system.inform("%s %s" % (msg, self.desired.representation(verbose=verbose)))
+            return True
 
     def cleanup(self):
-        """Cleanup older installs"""
+        """
+        Cleanup older installs (see pickley.garbage)
+
+        :return int: Number of deleted older installs
+        """
         cutoff = time.time() - system.SETTINGS.install_timeout * 60
         folder = system.SETTINGS.meta.full_path(self.package_spec.dashed)
-
-        removed_entry_points = runez.read_json(self.removed_entry_points_path, default=[], fatal=False)
+        removed_entry_points = self.removed_entry_points
+        installs = system.SETTINGS.state.get(self.package_spec.dashed, "installs", default={})
+        current = set(installs.get("current") or [])
+        known = installs.get("groups") or {}  # Prefix index: install name -> group it belongs to (entry point, package, ...)
+        groups = {}
 
         prefixes = {None: [], self.package_spec.dashed: []}
         for name in self.entry_points:
@@ -526,15 +696,25 @@ class Packager(object):
             for name in os.listdir(folder):
                 if name.startswith("."):
                     continue
-                target = find_prefix(prefixes, name)
-                if target in prefixes:
-                    fpath = os.path.join(folder, name)
-                    prefixes[target].append((os.path.getmtime(fpath), fpath))
+
+                if name in known:
+                    target = known[name]
+
+                else:
+                    target = find_prefix(prefixes, name)
+                    if target and name.endswith(PEX_EXTENSION):
+                        # Shared pex files are cleaned up independently from their launchers
+                        target += PEX_EXTENSION
+
+                groups[name] = target
+                fpath = os.path.join(folder, name)
+                prefixes.setdefault(target, []).append((os.path.getmtime(fpath), fpath))
 
         # Sort each by last modified timestamp
         for target, cleanable in prefixes.items():
             prefixes[target] = sorted(cleanable, reverse=True)
 
+        deleted = 0
         rem_cleaned = 0
         for target, cleanable in prefixes.items():
             if not cleanable:
@@ -558,10 +738,25 @@ class Packager(object):
                 cleanable = cleanable[1:]
 
             for _, path in cleanable:
-                runez.delete(path)
+                name = os.path.basename(path)
+                if name not in current and runez.delete(path) > 0:
+                    groups.pop(name, None)
+                    deleted += 1
 
         if rem_cleaned >= len(removed_entry_points):
-            runez.delete(self.removed_entry_points_path)
+            system.SETTINGS.state.put(self.package_spec.dashed, "removed-entry-points", None)
+
+        if groups != known:
+            installs["groups"] = groups
+            system.SETTINGS.state.put(self.package_spec.dashed, "installs", installs)
+
+        return deleted
+
+    def record_installs(self):
+        """Remember which installs (in meta folder) are currently in use, those are never deleted by cleanup"""
+        installs = system.SETTINGS.state.get(self.package_spec.dashed, "installs", default={})
+        installs["current"] = sorted(self.installed)
+        system.SETTINGS.state.put(self.package_spec.dashed, "installs", installs)
 
     def effective_install(self):
         """Install this pypi cli to self.dist_folder"""
@@ -577,7 +772,7 @@ class Packager(object):
         deliverer = DELIVERERS.resolved(self.package_spec, default=self.desired.delivery)
         for name in self.entry_points:
             target = system.SETTINGS.base.full_path(name)
-            if self.package_spec.dashed != system.PICKLEY and not self.current.file_exists:
+            if self.package_spec.dashed != system.PICKLEY and not self.current.stored:
                 uninstall_existing(target)
             path = template.format(meta=system.SETTINGS.meta.full_path(self.package_spec.dashed), name=name, version=self.desired.version)
             deliverer.install(target, path)
@@ -590,22 +785,31 @@ class PexPackager(Packager):
     Package/install via pex (https://pypi.org/project/pex/)
     """
 
+    shared_pex = None  # type: str # Path to pex shared by all entry points, if any (populated by self.effective_package())
+
     def pex_build(self, name, destination):
         """
         Run pex build
 
-        :param str name: Name of entry point
+        :param str|None name: Name of entry point (None: produce a pex where entry point is selected via PEX_SCRIPT)
         :param str destination: Path to file where to produce pex
         :return str: None if successful, error message otherwise
         """
         runez.ensure_folder(self.build_folder, folder=True)
         runez.delete(destination)
 
-        args = ["--cache-dir", self.build_folder, "--repo", self.build_folder]
-        args.extend(["-c%s" % name, "-o%s" % destination, self.package_spec.specced])
+        args = ["--cache-dir", self.build_folder]
+        args.extend(pex_index_args(install_index()))
+        for folder in self.wheel_folders():
+            args.extend(["--repo", folder])
+
+        if name:
+            args.append("-c%s" % name)
+
+        args.extend(["-o%s" % destination, self.package_spec.specced])
 
         python = system.target_python(package_spec=self.package_spec)
-        shebang = python.shebang(universal=system.is_universal(self.build_folder))
+        shebang = python.shebang(universal=system.is_universal(self.wheel_dir))
         if shebang:
             args.append("--python-shebang")
             args.append(shebang)
@@ -617,10 +821,30 @@ class PexPackager(Packager):
         :param str template: Template describing how to name delivered files, example: {meta}/{name}-{version}
         """
         self.executables = []
+        self.shared_pex = None
+        if len(self.entry_points) > 1 and not self.source_folder:
+            # Build pex only once, entry points differ only by the script they run.
+            # Not done for 'pickley package': launchers refer to shared pex via its absolute path, artifacts must remain movable
+            dest = template.format(name=self.package_spec.dashed, version=self.desired.version) + PEX_EXTENSION
+            self.shared_pex = os.path.join(self.dist_folder, dest)
+            self.pex_build(None, self.shared_pex)
+            self.packaged.append(self.shared_pex)
+
         for name in self.entry_points:
             dest = template.format(name=name, version=self.desired.version)
             dest = os.path.join(self.dist_folder, dest)
-            self.pex_build(name, dest)
+            if self.shared_pex:
+                contents = PEX_LAUNCHER.lstrip().format(
+                    name=runez.quoted(name, adapter=None),
+                    pex=runez.quoted(self.shared_pex, adapter=None),
+                )
+                runez.delete(dest, logger=None)
+                runez.write(dest, contents)
+                runez.make_executable(dest)
+
+            else:
+                self.pex_build(name, dest)
+
             self.packaged.append(dest)
             self.executables.append(dest)
 
@@ -628,10 +852,16 @@ class PexPackager(Packager):
         """Install this pypi cli to self.dist_folder"""
         self.package()
         if self.packaged:
+            shared_pex = self.shared_pex and system.SETTINGS.meta.full_path(self.package_spec.dashed, os.path.basename(self.shared_pex))
             for path in self.packaged:
                 name = os.path.basename(path)
                 target = system.SETTINGS.meta.full_path(self.package_spec.dashed, name)
                 move_venv(path, target)
+                self.installed.append(name)
+                if shared_pex and path != self.shared_pex:
+                    # Point launcher to where shared pex was moved to
+                    relocate_venv(target, self.shared_pex, shared_pex)
+
             self.perform_delivery("{meta}/{name}-{version}")
 
 
@@ -651,13 +881,27 @@ class VenvPackager(Packager):
     Install via virtualenv (https://pypi.org/project/virtualenv/)
     """
 
-    def effective_package(self, template):
+    previous_venv = None  # type: str # Path to currently installed venv, to upgrade incrementally from (set by self.effective_install())
+
+    def incremental_source(self):
         """
-        :param str template: Template describing how to name delivered files, example: {meta}/{name}-{version}
+        :return str|None: Path to currently installed venv, if it can be cloned to upgrade incrementally
         """
-        folder = os.path.join(self.dist_folder, template.format(name=self.package_spec.dashed, version=self.desired.version))
-        clean_folder(folder)
+        if self.relocatable or self.source_folder or not self.current.valid or self.current.packager != self.implementation_name:
+            return None
+
+        if self.current.version == self.desired.version or self.current.python != self.desired.python:
+            return None  # Forced re-installs, or python changes, get a fresh venv
 
+        path = system.SETTINGS.meta.full_path(self.package_spec.dashed, "%s-%s" % (self.package_spec.dashed, self.current.version))
+        if runez.is_executable(os.path.join(path, "bin", "python")):
+            return path
+
+    def create_venv(self, folder):
+        """
+        :param str folder: Folder where to create a fresh venv
+        """
+        clean_folder(folder)
         python = system.target_python(package_spec=self.package_spec)
         if not python.has_builtin_venv or self.relocatable:
             venv = "virtualenv==16.7.7"
@@ -666,10 +910,70 @@ class VenvPackager(Packager):
             venv = "venv"
 
         vrun(self.package_spec, venv, folder)
+
+    @staticmethod
+    def stale_distributions(folder, pinned):
+        """
+        :param str folder: Venv to inspect
+        :param list pinned: Exact requirements ('name==version') the venv should end up with
+        :return list: Distributions installed in 'folder' that are not part of 'pinned' (pip, setuptools and wheel are kept)
+        """
+        keep = set(system.despecced(spec)[0] for spec in pinned).union(VENV_BOOTSTRAP)
+        return sorted(name for name in ToolVenv(folder).scanned_frozen() if name not in keep)
+
+    def is_relocated(self, path):
+        """
+        :param str path: Script in a clone of self.previous_venv
+        :return bool: True if 'path' doesn't refer to self.previous_venv anymore (running it would modify current install otherwise)
+        """
+        try:
+            with open(path) as fh:
+                return self.previous_venv not in fh.read()
+
+        except (IOError, OSError):
+            return False
+
+    def effective_package(self, template):
+        """
+        :param str template: Template describing how to name delivered files, example: {meta}/{name}-{version}
+        """
+        folder = os.path.join(self.dist_folder, template.format(name=self.package_spec.dashed, version=self.desired.version))
         bin_folder = os.path.join(folder, "bin")
         pip = os.path.join(bin_folder, "pip")
-        spec = self.source_folder if self.source_folder else "%s==%s" % (self.package_spec.dashed, self.desired.version)
-        runez.run(pip, "install", "-i", system.SETTINGS.index, "-f", self.build_folder, spec)
+        pinned = self.pinned_requirements()
+        if pinned:
+            # 'pip wheel' already resolved all dependencies, install its exact output without querying index again
+            pip_args = ["install", "--no-index", "--no-deps", "-f", self.wheel_dir, pinned]
+
+        else:
+            spec = self.source_folder if self.source_folder else "%s==%s" % (self.package_spec.dashed, self.desired.version)
+            find_links = [["-f", path] for path in self.wheel_folders()]
+            pip_args = ["install", pip_index_args(install_index()), find_links, spec]
+
+        incremental = False
+        if self.previous_venv and pinned:
+            # Clone current install (reflinks when supported): pip then only applies distributions that changed.
+            # Hardlinks are not used, as pip can modify files in place (that would affect the current install).
+            # Only done with a pinned wheel set: without it, pip would keep older dependencies than a fresh install picks
+            runez.delete(folder, logger=None)
+            incremental = copy_venv(self.previous_venv, folder, fatal=False) > 0 and self.is_relocated(pip)
+            if not incremental:
+                LOG.info("Could not clone %s, installing from scratch", short(self.previous_venv))
+
+        if incremental:
+            # Remove distributions the new version doesn't need anymore, before installing (they may share files with new ones)
+            stale = self.stale_distributions(folder, pinned)
+            r = runez.run(pip, "uninstall", "-y", stale, fatal=False) if stale else None
+            if r is None or r.succeeded:
+                r = runez.run(pip, *pip_args, fatal=False)
+
+            if not r.succeeded:
+                LOG.info("Incremental upgrade from %s failed, installing from scratch", short(self.previous_venv))
+                incremental = False
+
+        if not incremental:
+            self.create_venv(folder)
+            runez.run(pip, *pip_args)
 
         if self.relocatable:
             python = system.target_python(package_spec=self.package_spec).executable
@@ -681,9 +985,11 @@ class VenvPackager(Packager):
 
     def effective_install(self):
         """Install this pypi cli to self.dist_folder"""
+        self.previous_venv = self.incremental_source()
         self.package()
         if self.packaged:
             path = self.packaged[0]
             target = system.SETTINGS.meta.full_path(self.package_spec.dashed, os.path.basename(path))
             move_venv(path, target)
+            self.installed.append(os.path.basename(target))
             self.perform_delivery(os.path.join(target, "bin", "{name}"))
@@ -1,129 +1,906 @@
+import codecs
+import copy
 import json
 import logging
 import os
 import re
-from distutils.version import StrictVersion
+import threading
+import time
+import zlib
+from functools import total_ordering
 
 try:  # python3
-    from urllib.request import Request, urlopen
+    from functools import lru_cache
 
 except ImportError:  # python2
+    lru_cache = None
+
+try:  # python3
+    from queue import Empty, Queue
+
+except ImportError:  # python2
+    from Queue import Empty, Queue
+
+try:  # python3
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.parse import urljoin, urlsplit
+    from urllib.request import getproxies, proxy_bypass, Request, urlopen
+
+except ImportError:  # python2
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib import getproxies, proxy_bypass
     from urllib2 import urlopen, Request
+    from urlparse import urljoin, urlsplit
 
 import runez
 
+import pickley
+from pickley import system
+
 
 LOG = logging.getLogger(__name__)
+CHUNK_SIZE = 64 * 1024
 DEFAULT_PYPI = "https://pypi.org/pypi/{name}/json"
+MAX_REDIRECTS = 5
 RE_BASENAME = re.compile(r'href=".+/([^/#]+)\.(tar\.gz|whl)#', re.IGNORECASE)
+RE_FILENAME = re.compile(r"^(.+)\.(tar\.gz|whl)$", re.IGNORECASE)
+RE_JSON_INFO = re.compile(r'\s*{\s*"info"\s*:\s*')
+RE_PEP440 = re.compile(
+    r"^v?(?:(?P<epoch>[0-9]+)!)?(?P<release>[0-9]+(?:\.[0-9]+)*)"
+    r"(?:[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>[0-9]+)?)?"
+    r"(?:-(?P<post_n1>[0-9]+)|[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>[0-9]+)?)?"
+    r"(?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>[0-9]+)?)?"
+    r"(?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?$",
+    re.IGNORECASE
+)
 RE_VERSION = re.compile(r"([^-]+)")
+SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+UNAVAILABLE = "error: index is unavailable"
 
+# See https://www.python.org/dev/peps/pep-0691/#version-format-selection
+SIMPLE_ACCEPT = "%s, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.01" % SIMPLE_JSON
 
-def request_get(url):
+
+def memoized(maxsize):
+    """Memoize decorated single-argument function, least recently used values are evicted past 'maxsize' entries"""
+    if lru_cache is not None:
+        return lru_cache(maxsize=maxsize)
+
+    def decorator(func):  # pragma: no cover, python2 only
+        cache = {}
+
+        def wrapper(arg):
+            if arg not in cache:
+                if len(cache) >= maxsize:
+                    cache.clear()
+                cache[arg] = func(arg)
+            return cache[arg]
+
+        return wrapper
+
+    return decorator
+
+
+@total_ordering
+class Version(object):
+    """
+    Parsed PEP 440 version, see https://www.python.org/dev/peps/pep-0440/
+    Versions compare via their 'key', a tuple following PEP 440 ordering rules
+    """
+
+    def __init__(self, text, key, is_prerelease):
+        """
+        :param str text: Version as given
+        :param tuple key: Comparison key
+        :param bool is_prerelease: True if this is a pre-release (or a dev release)
+        """
+        self.text = text
+        self.key = key
+        self.is_prerelease = is_prerelease
+
+    def __repr__(self):
+        return self.text
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self.key == other.key
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+PRE_RELEASE_RANK = {"a": 0, "alpha": 0, "b": 1, "beta": 1, "c": 2, "pre": 2, "preview": 2, "rc": 2}
+
+
+@memoized(maxsize=4096)
+def parsed_version(text):
+    """
+    :param str text: Version to parse
+    :return Version|None: Parsed version, if 'text' is a valid PEP 440 version
+    """
+    m = text and RE_PEP440.match(text.strip())
+    if not m:
+        return None
+
+    release = [int(n) for n in m.group("release").split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()  # 1.0 == 1.0.0
+
+    pre_l = m.group("pre_l")
+    post_n = m.group("post_n1") or m.group("post_n2")
+    has_post = post_n is not None or m.group("post_l") is not None
+    dev_l = m.group("dev_l")
+    if pre_l:
+        pre = (0, PRE_RELEASE_RANK[pre_l.lower()], int(m.group("pre_n") or 0))
+
+    elif dev_l and not has_post:
+        pre = (-1,)  # 1.0.dev0 sorts before 1.0a0
+
+    else:
+        pre = (1,)
+
+    post = (0, int(post_n or 0)) if has_post else (-1,)
+    dev = (0, int(m.group("dev_n") or 0)) if dev_l else (1,)
+    local = m.group("local")
+    if local:
+        local = tuple((1, int(p), "") if p.isdigit() else (0, 0, p.lower()) for p in re.split(r"[-_.]", local))
+
+    else:
+        local = ()
+
+    key = (int(m.group("epoch") or 0), tuple(release), pre, post, dev, local)
+    return Version(text, key, bool(pre_l or dev_l))
+
+
+def same_version(text1, text2):
+    """
+    :param str|None text1: Version to compare
+    :param str|None text2: Other version to compare
+    :return bool: True if both texts represent the same version (as per PEP 440, if applicable)
+    """
+    if text1 == text2:
+        return True
+
+    v1 = parsed_version(text1)
+    return v1 is not None and v1 == parsed_version(text2)
+
+
+class IndexResponse(object):
+    """
+    Response obtained from a pypi index, body can be consumed as a stream via chunks()
+    """
+
+    def __init__(self, url, status, headers, body=None, stream=None):
+        """
+        :param str url: URL that was queried (after redirects, if any)
+        :param int status: HTTP status code
+        :param dict headers: Response headers (lowercased names)
+        :param bytes|str|None body: Response body, if already fully read
+        :param ResponseStream|None stream: Stream to read body from, if not already read
+        """
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self._stream = stream
+        self._text = None
+
+    def __repr__(self):
+        return "%s %s" % (self.status, self.url)
+
+    def _raw_chunks(self):
+        if self._stream is None:
+            if self.body:
+                yield self.body
+
+            return
+
+        stream = self._stream
+        self._stream = None
+        complete = False
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    complete = True
+                    return
+
+                yield chunk
+
+        finally:
+            stream.close(complete)
+
+    def chunks(self):
+        """
+        Yields decoded chunks of body as they arrive, closing the generator early leaves the rest of the body unread
+
+        :return str: Decoded chunk of body
+        """
+        raw_chunks = self._raw_chunks()
+        decompressor = None
+        if self.headers.get("content-encoding") == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            for chunk in raw_chunks:
+                if not isinstance(chunk, bytes):
+                    yield chunk
+                    continue
+
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+
+                chunk = decoder.decode(chunk)
+                if chunk:
+                    yield chunk
+
+            chunk = decoder.decode(decompressor.flush() if decompressor is not None else b"", final=True)
+            if chunk:
+                yield chunk
+
+        finally:
+            raw_chunks.close()
+
+    def close(self):
+        """Stop reading body, if not already done"""
+        if self._stream is not None:
+            self._stream.close(False)
+            self._stream = None
+
+    @property
+    def text(self):
+        """
+        :return str|None: Decoded body
+        """
+        if self._text is None:
+            self._text = "".join(self.chunks()).strip()
+
+        return self._text or None
+
+
+class ResponseStream(object):
+    """
+    Body of a response being read from a pooled connection
+    """
+
+    def __init__(self, client, key, connection, response):
+        """
+        :param IndexClient client: Client that owns 'connection'
+        :param tuple key: (scheme, netloc) identifying the pool of 'connection'
+        :param HTTPConnection connection: Connection 'response' is being read from
+        :param HTTPResponse response: Response being read
+        """
+        self.client = client
+        self.key = key
+        self.connection = connection
+        self.response = response
+
+    def read(self, size):
+        return self.response.read(size)
+
+    def close(self, complete):
+        """
+        :param bool complete: True if body was read fully (connection can then be reused)
+        """
+        if self.connection is not None:
+            if complete and not self.response.will_close:
+                self.client.release(self.key, self.connection)
+
+            else:
+                self.connection.close()
+
+            self.connection = None
+
+
+class IndexClient(object):
+    """
+    Minimal HTTP client keeping connections alive per index host, and negotiating gzip
+
+    Version checks typically query the same index repeatedly (one request per package),
+    reusing connections avoids paying for a new TCP + TLS handshake on each query.
+    """
+
+    def __init__(self):
+        self._idle = {}  # Idle connections, by (scheme, netloc)
+        self._lock = threading.Lock()
+        self._user_agent = None
+
+    @property
+    def user_agent(self):
+        if self._user_agent is None:
+            self._user_agent = "pickley/%s" % runez.get_version(pickley)
+        return self._user_agent
+
+    def _connection(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, netloc = key
+        connection_type = HTTPSConnection if scheme == "https" else HTTPConnection
+        connection = connection_type(netloc, timeout=system.SETTINGS.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(system.SETTINGS.read_timeout)
+        return connection, False
+
+    def release(self, key, connection):
+        """
+        :param tuple key: (scheme, netloc) identifying the pool of 'connection'
+        :param HTTPConnection connection: Connection to make available for subsequent requests
+        """
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _request(self, key, path, headers):
+        """
+        :return ResponseStream: Response, with its body not read yet
+        """
+        connection, reused = self._connection(key)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+
+        except (HTTPException, IOError, OSError):
+            connection.close()
+            if not reused:
+                raise
+
+            # Server closed idle keep-alive connection on its end, retry with a fresh one
+            connection, _ = self._connection(key)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+
+        return ResponseStream(self, key, connection, response)
+
+    def get(self, url, headers=None, stream=False):
+        """
+        :param str url: URL to query
+        :param dict|None headers: Optional additional request headers
+        :param bool stream: If True, don't read body right away (caller is then responsible to consume it, or close it)
+        :return IndexResponse: Response from index
+        """
+        request_headers = {
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+            "User-Agent": self.user_agent,
+        }
+        if headers:
+            request_headers.update(headers)
+
+        for _ in range(MAX_REDIRECTS + 1):
+            LOG.debug("GET %s", url)
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.netloc:
+                raise ValueError("Unsupported URL '%s'" % url)
+
+            if is_proxied(parts):
+                response = self._proxied_get(url, request_headers)
+
+            else:
+                path = parts.path or "/"
+                if parts.query:
+                    path = "%s?%s" % (path, parts.query)
+
+                response_stream = self._request((parts.scheme, parts.netloc), path, request_headers)
+                response_headers = dict((k.lower(), v) for k, v in response_stream.response.getheaders())
+                response = IndexResponse(url, response_stream.response.status, response_headers, stream=response_stream)
+
+            location = response.headers.get("location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.text  # Consume body, allows to reuse connection
+                url = urljoin(url, location)
+                continue
+
+            if not stream:
+                response.text
+
+            return response
+
+        raise ValueError("Too many redirects for '%s'" % url)
+
+    def _proxied_get(self, url, headers):
+        """Let urllib deal with proxies"""
+        request = Request(url, headers=headers)  # nosec
+        try:
+            response = urlopen(request)  # nosec
+            status = response.getcode()
+
+        except Exception as e:
+            status = getattr(e, "code", None)
+            if not isinstance(status, int):
+                raise
+
+            response = e
+
+        response_headers = dict((k.lower(), v) for k, v in response.info().items())
+        return IndexResponse(response.geturl(), status, response_headers, body=response.read())
+
+
+CLIENT = IndexClient()
+
+
+def is_proxied(parts):
+    """
+    :param parts: Result of urlsplit() of URL to examine
+    :return bool: True if a proxy is configured for this URL
+    """
+    return bool(getproxies().get(parts.scheme)) and not proxy_bypass(parts.hostname or "")
+
+
+def index_response(url, headers=None, stream=False):
     """
     :param str url: URL to query
-    :return str: Response body
+    :param dict|None headers: Optional additional request headers
+    :param bool stream: If True, don't read body right away (caller is then responsible to consume it, or close it)
+    :return IndexResponse|None: Response, if index answered (None on transport errors, or server errors)
     """
     try:
-        LOG.debug("GET %s", url)
-        request = Request(url)  # nosec
-        response = urlopen(request).read()  # nosec
-        return response and runez.decode(response).strip()
+        response = CLIENT.get(url, headers=headers, stream=stream)
+        if response.status < 500:
+            return response
+
+        response.close()
+        LOG.debug("GET %s returned status %s", url, response.status)
 
     except Exception as e:
-        code = getattr(e, "code", None)
-        if isinstance(code, int) and 400 <= code < 500:
-            return None
+        LOG.debug("GET %s failed: %s", url, e)
 
-        try:
-            # Some old python installations have trouble with SSL (OSX for example), try curl
-            result = runez.run("curl", "-s", url, dryrun=False, fatal=False)
-            if result.succeeded and result.output:
-                return result.output
+    try:
+        # Last resort, some old python installations have trouble with SSL (OSX for example), try curl
+        result = runez.run("curl", "-s", url, dryrun=False, fatal=False)
+        if result.succeeded and result.output:
+            return IndexResponse(url, 200, {}, body=result.output)
 
-        except Exception as e:
-            LOG.debug("GET %s failed: %s", url, e, exc_info=e)
+    except Exception as e:
+        LOG.debug("GET %s failed: %s", url, e, exc_info=e)
 
     return None
 
 
-def latest_pypi_version(url, package_spec):
+def request_get(url):
+    """
+    :param str url: URL to query
+    :return str: Response body
+    """
+    response = index_response(url)
+    if response is not None and response.status == 200:
+        return response.text
+
+    return None
+
+
+def local_wheelhouse(url):
+    """
+    :param str|None url: Pypi index to use
+    :return str|None: Path to local folder of wheels and sdists, if 'url' refers to one (ie: of the form file://...)
+    """
+    if url and url.startswith("file://"):
+        return runez.resolved_path(url[7:])
+
+
+def pip_index_args(url):
+    """
+    :param str|None url: Pypi index to use (default: pypi.org)
+    :return list: Command line args telling pip which index to use
+    """
+    folder = local_wheelhouse(url)
+    if folder:
+        # Never touch the network when a local wheelhouse is configured
+        return ["--no-index", "--find-links", folder]
+
+    if url:
+        return ["-i", url]
+
+    return []
+
+
+def pex_index_args(url):
     """
     :param str|None url: Pypi index to use (default: pypi.org)
+    :return list: Command line args telling pex which index to use
+    """
+    folder = local_wheelhouse(url)
+    if folder:
+        # Never touch the network when a local wheelhouse is configured
+        return ["--no-pypi", "--repo", folder]
+
+    if url:
+        return ["--no-pypi", "--index-url", url]
+
+    return []
+
+
+class MirrorStats(object):
+    """Latency and health of configured index mirrors, remembered in <base>/.pickley/mirrors.json"""
+
+    def __init__(self):
+        self.path = None
+        self.data = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        path = system.SETTINGS.meta.full_path("mirrors.json")
+        if path != self.path:
+            self.path = path
+            self.data = runez.read_json(path, default={}, fatal=False)
+
+    def ordered(self, urls):
+        """
+        :param list urls: Configured mirrors, in configured order
+        :return list: Same mirrors, healthy and fastest first
+        """
+        with self._lock:
+            self._load()
+            positions = dict((url, i) for i, url in enumerate(urls))
+            return sorted(urls, key=lambda url: self._sort_key(url, positions[url]))
+
+    def _sort_key(self, url, position):
+        info = self.data.get(url) or {}
+        return min(info.get("failures", 0), 3), info.get("latency", 0), position
+
+    def record(self, samples):
+        """
+        :param list samples: Tuples (url, seconds, healthy) of attempts made against mirrors (healthy None: outcome unknown)
+        """
+        with self._lock:
+            self._load()
+            for url, seconds, healthy in samples:
+                info = self.data.get(url) or {}
+                latency = info.get("latency")
+                # Exponentially weighted moving average, recent samples weigh more
+                info["latency"] = round(seconds if latency is None else 0.7 * latency + 0.3 * seconds, 3)
+                if healthy is not None:
+                    info["failures"] = 0 if healthy else info.get("failures", 0) + 1
+
+                self.data[url] = info
+
+            runez.save_json(self.data, self.path, fatal=False, logger=None)
+
+
+MIRRORS = MirrorStats()
+
+
+def install_index():
+    """
+    :return str|None: Index that pip and pex should use: healthiest and fastest known mirror (first configured one initially)
+    """
+    indexes = system.SETTINGS.indexes
+    return MIRRORS.ordered(indexes)[0] if indexes else None
+
+
+def _hedged_version(urls, package_spec, cached):
+    """
+    Query mirrors (fastest known first), querying the next one when current ones didn't answer within 'hedge_delay'
+
+    :param list urls: Index mirrors to use
     :param system.PackageSpec package_spec: Pypi package
+    :param pickley.package.VersionMeta|None cached: Previously determined latest version, its validators get refreshed from winner
     :return str: Determined latest version, if any
     """
+    pending = MIRRORS.ordered(urls)
+    started = {}
+    results = Queue()
+
+    def attempt(url):
+        meta = copy.copy(cached)
+        try:
+            version = latest_pypi_version(url, package_spec, cached=meta)
+
+        except Exception as e:
+            version = "%s: %s" % (UNAVAILABLE, e)
+
+        results.put((url, version, meta))
+
+    def launch():
+        url = pending.pop(0)
+        started[url] = time.time()
+        thread = threading.Thread(target=attempt, args=(url,))
+        thread.daemon = True  # Slow mirrors don't prevent us from exiting
+        thread.start()
+
+    launch()
+    samples = []
+    version = None
+    while started:
+        try:
+            url, version, meta = results.get(timeout=system.SETTINGS.hedge_delay if pending else None)
+
+        except Empty:
+            LOG.debug("No response yet from %s, querying %s as well", ", ".join(started), pending[0])
+            launch()
+            continue
+
+        success = bool(version) and not version.startswith("error: ")
+        # Mirrors that answered, even if they don't host 'package_spec', are healthy
+        healthy = success or not (version and version.startswith(UNAVAILABLE))
+        samples.append((url, time.time() - started.pop(url), healthy))
+        if success:
+            if cached is not None and meta is not None:
+                cached.etag, cached.last_modified, cached.serial = meta.etag, meta.last_modified, meta.serial
+
+            break
+
+        if pending:
+            launch()
+
+    now = time.time()
+    for url, start in started.items():
+        # Mirrors that didn't answer in time are at least that slow
+        samples.append((url, now - start, None))
+
+    MIRRORS.record(samples)
+    return version
+
+
+def _conditional_headers(cached):
+    """
+    :param pickley.package.VersionMeta|None cached: Previously determined latest version, if any
+    :return dict: Headers allowing index to respond with '304 Not Modified'
+    """
+    headers = {}
+    if cached is not None and cached.version:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    return headers
+
+
+def latest_pypi_version(url, package_spec, cached=None):
+    """
+    :param str|list|None url: Pypi index to use (default: pypi.org), or list of mirrors
+    :param system.PackageSpec package_spec: Pypi package
+    :param pickley.package.VersionMeta|None cached: Previously determined latest version, its validators get refreshed from response
+    :return str: Determined latest version, if any
+    """
+    if isinstance(url, (list, tuple)):
+        if len(url) > 1:
+            return _hedged_version(url, package_spec, cached)
+
+        url = url[0] if url else None
+
     if not url:
         url = DEFAULT_PYPI
 
+    folder = local_wheelhouse(url)
+    if folder:
+        return _wheelhouse_version(package_spec, folder)
+
+    headers = _conditional_headers(cached)
     if "{name}" in url:
         url = url.format(name=package_spec.dashed)
 
     else:
-        # Assume legacy only for now for custom pypi indices
+        # Custom pypi indices are assumed to be "simple" ones, prefer their json form if they support it
         url = os.path.join(url, package_spec.dashed)
+        headers["Accept"] = SIMPLE_ACCEPT
+
+    response = index_response(url, headers=headers, stream=True)
+    if response is None:
+        return "%s: %s" % (UNAVAILABLE, url)
+
+    if response.status != 200:
+        response.text  # Consume body (empty for 304, short for 4xx), allows to reuse connection
+        if response.status == 304 and cached is not None and cached.version:
+            # Nothing changed since last query
+            return cached.version
 
-    data = request_get(url)
-    if not data:
         return "error: can't determine latest version from '%s'" % url
 
-    if data[0] == "{":
-        # See https://warehouse.pypa.io/api-reference/json/
-        try:
-            data = json.loads(data)
-            return data.get("info", {}).get("version")
+    if cached is not None:
+        serial = response.headers.get("x-pypi-last-serial", "")
+        if serial and serial == cached.serial and cached.version:
+            # Nothing published since last query, no need to look at body
+            response.close()
+            return cached.version
 
-        except Exception as e:
-            LOG.warning("Failed to parse pypi json from %s: %s\n%s", url, e, data)
+        cached.etag = response.headers.get("etag", "")
+        cached.last_modified = response.headers.get("last-modified", "")
+        cached.serial = serial
+
+    chunks = response.chunks()
+    try:
+        head = ""
+        for chunk in chunks:
+            head += chunk
+            if head.strip():
+                break
+
+        if not head.strip():
+            return "error: can't determine latest version from '%s'" % url
+
+        if head.lstrip()[0] == "{":
+            return _json_version(package_spec, url, response, head, chunks)
+
+        return _legacy_pypi_version(package_spec, url, _lines(head, chunks))
+
+    finally:
+        chunks.close()
 
-        return "error: can't determine latest version from '%s'" % url
 
-    return _legacy_pypi_version(package_spec, url, data)
+def _lines(head, chunks):
+    """
+    :param str head: First chunk(s) already read
+    :param chunks: Remaining chunks
+    :return str: Lines, as they become available
+    """
+    pending = head
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+
+    for line in pending.split("\n"):
+        yield line
 
 
-def _legacy_pypi_version(package_spec, url, data):
+def _json_version(package_spec, url, response, data, chunks):
     """
     Args:
         package_spec (system.PackageSpec): Pypi package
         url (str): Pypi url that delivered 'data'
-        data (str): HTML from pypi/simple
+        response (IndexResponse): Response being parsed
+        data (str): First chunk(s) already read
+        chunks: Remaining chunks
 
     Returns:
         (str): Latest usable version, or problem (string starting with 'error:')
     """
-    latest = None
-    latest_text = None
-    prereleases = []
-    for line in data.splitlines():
+    # Warehouse json starts with the (relatively small) "info" section: stop reading as soon as it is fully available
+    decoder = json.JSONDecoder()
+    while True:
+        m = RE_JSON_INFO.match(data)
+        if m:
+            try:
+                info, _ = decoder.raw_decode(data, m.end())
+                return info.get("version") if isinstance(info, dict) else None
+
+            except ValueError:
+                pass  # Incomplete yet
+
+        elif not '"info"'.startswith(data.lstrip().lstrip("{").lstrip()[:6]):
+            break  # Not a warehouse json, or "info" is not first: needs full parse
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+
+        data += chunk
+
+    data += "".join(chunks)
+    try:
+        data = json.loads(data)
+        if response.headers.get("content-type", "").startswith(SIMPLE_JSON) or "files" in data:
+            # See https://www.python.org/dev/peps/pep-0691/
+            return _simple_json_version(package_spec, url, data)
+
+        # See https://warehouse.pypa.io/api-reference/json/
+        return data.get("info", {}).get("version")
+
+    except Exception as e:
+        LOG.warning("Failed to parse pypi json from %s: %s\n%s", url, e, data)
+
+    return "error: can't determine latest version from '%s'" % url
+
+
+def _simple_json_version(package_spec, url, data):
+    """
+    Args:
+        package_spec (system.PackageSpec): Pypi package
+        url (str): Pypi url that delivered 'data'
+        data (dict): Deserialized PEP 691 json from pypi/simple
+
+    Returns:
+        (str): Latest usable version, or problem (string starting with 'error:')
+    """
+    basenames = []
+    for info in data["files"]:
+        if not info.get("yanked"):
+            m = RE_FILENAME.match(info.get("filename") or "")
+            if m:
+                basenames.append(m.group(1))
+
+    return _latest_version(package_spec, url, basenames)
+
+
+def _wheelhouse_version(package_spec, folder):
+    """
+    Args:
+        package_spec (system.PackageSpec): Pypi package
+        folder (str): Local folder of wheels and sdists
+
+    Returns:
+        (str): Latest usable version, or problem (string starting with 'error:')
+    """
+    try:
+        names = os.listdir(folder)
+
+    except OSError:
+        return "error: can't read wheelhouse '%s'" % runez.short(folder)
+
+    basenames = []
+    for name in names:
+        m = RE_FILENAME.match(name)
+        if m:
+            basenames.append(m.group(1))
+
+    return _latest_version(package_spec, folder, basenames)
+
+
+def _legacy_pypi_version(package_spec, url, lines):
+    """
+    Args:
+        package_spec (system.PackageSpec): Pypi package
+        url (str): Pypi url that delivered 'lines'
+        lines: Lines of HTML from pypi/simple
+
+    Returns:
+        (str): Latest usable version, or problem (string starting with 'error:')
+    """
+    return _latest_version(package_spec, url, _legacy_basenames(lines))
+
+
+def _legacy_basenames(lines):
+    for line in lines:
         m = RE_BASENAME.search(line)
-        if not m:
-            continue
+        if m:
+            yield m.group(1)
+
+
+def _latest_version(package_spec, url, basenames):
+    """
+    Args:
+        package_spec (system.PackageSpec): Pypi package
+        url (str): Pypi url that delivered 'basenames'
+        basenames: Published file names, without their extension
 
-        version_part = package_spec.version_part(m.group(1))
+    Returns:
+        (str): Latest usable version, or problem (string starting with 'error:')
+    """
+    latest = None
+    prereleases = False
+    for basename in basenames:
+        version_part = package_spec.version_part(basename)
         if not version_part:
             continue
 
         m = RE_VERSION.match(version_part)
         if m:
-            try:
-                version_text = m.group(1)
-                canonical_version = version_text
-                if "+" in canonical_version:
-                    canonical_version, _, _ = canonical_version.partition("+")
-                value = StrictVersion(canonical_version)
-                if value.prerelease:
-                    prereleases.append(version_text)
-                elif latest is None or latest < value:
-                    latest = value
-                    latest_text = version_text
+            value = parsed_version(m.group(1))
+            if value is None:
+                continue
 
-            except ValueError:
-                pass
+            if value.is_prerelease:
+                prereleases = True
+
+            elif latest is None or latest < value:
+                latest = value
+
+    if latest is not None:
+        return latest.text
 
-    if not latest_text:
-        if prereleases:
-            latest_text = "error: all published versions are pre-releases"
-        else:
-            latest_text = "error: can't determine latest version from '%s'" % url
+    if prereleases:
+        return "error: all published versions are pre-releases"
 
-    return latest_text
+    return "error: can't determine latest version from '%s'" % url
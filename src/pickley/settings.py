@@ -8,9 +8,12 @@ tree <base>
 ├── .pickley/                       # Folder where pickley will build/manage/track installations
 │   ├── audit.log                   # Activity is logged here
 │   ├── config.json                 # Optional configuration provided by user
+│   ├── manifest.json               # Cached copy of configured 'manifest' (if any)
+│   ├── state.db                    # Metadata of installed packages: current and latest version, entry points
+│   ├── _venvs/
+│   │   └── _tools/py37/pex-1.6.12/ # Cached venvs of tools used by pickley (pex, virtualenv, ...), per python and tool version
 │   ├── tox/
-│   │   ├── .current.json           # Currently installed version
-│   │   ├── .latest.json            # Latest version as determined by querying pypi
+│   │   ├── .ping                   # Touched on each install or auto-upgrade check
 │   │   ├── .tmp/                   # Temp folder used during installation
 │   │   ├── .tmp.lock               # Soft lock file containing pid of pickley process that currently hold the lock on .tmp/
 │   │   └── tox-2.9.1/              # Actual installation, as packaged by pickley
@@ -18,18 +21,27 @@ tree <base>
 └── tox -> .pickley/tox/2.9.1/...   # Produced exe, can be a symlink or a small wrapper exe (to ensure up-to-date)
 """
 
+import json
 import logging
 import os
+import threading
 
 import runez
 
 from pickley import system
+from pickley.pypi import request_get
+from pickley.state import StateStore
 
 
 LOG = logging.getLogger(__name__)
 DOT_PICKLEY = ".pickley"
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_ERROR_CHECK_DELAY = 1
+DEFAULT_HEDGE_DELAY = 1
 DEFAULT_INSTALL_TIMEOUT = 30
+DEFAULT_READ_TIMEOUT = 30
 DEFAULT_VERSION_CHECK_DELAY = 10
+DEFAULT_WHEEL_CACHE_SIZE = 2048
 REPRESENTATION_WIDTH = 90
 
 
@@ -271,6 +283,86 @@ class SettingsFile(object):
         return "\n".join(result)
 
 
+class ManifestFile(SettingsFile):
+    """
+    Versions per channel, published as one json document (local path or URL) of the form: {"channel": {"stable": {"tox": "3.2.1"}}}
+    Document is fetched at most once per 'version_check_delay', and cached in <base>/.pickley/manifest.json
+    """
+
+    def __init__(self, parent, path, base=None):
+        """
+        :param Settings parent: Parent settings object
+        :param str path: Path or URL to manifest
+        :param str|None base: Base path to use to resolve relative paths (default: current working dir)
+        """
+        if "://" not in path:
+            path = runez.resolved_path(path, base=base)
+        super(ManifestFile, self).__init__(parent, path)
+        self._lock = threading.Lock()
+
+    @property
+    def cache_path(self):
+        return self.parent.meta.full_path("manifest.json")
+
+    @property
+    def contents(self):
+        """
+        :return dict: Channel definitions from manifest
+        """
+        with self._lock:
+            if self._contents is None:
+                self.set_contents(channel=self._channels())
+        return self._contents
+
+    def _fetch(self):
+        """
+        :return dict|None: Raw contents of manifest
+        """
+        if "://" not in self.path:
+            return runez.read_json(self.path, default=None, fatal=False)
+
+        data = request_get(self.path)
+        try:
+            return data and json.loads(data)
+
+        except ValueError as e:
+            LOG.debug("Invalid json in %s: %s", self.path, e)
+            return None
+
+    def _channels(self):
+        """
+        :return dict: Channel definitions, from cache if recent enough
+        """
+        cached = runez.read_json(self.cache_path, default={}, fatal=False)
+        if cached.get("manifest") != self.path:
+            cached = {}
+
+        elif runez.file.is_younger(self.cache_path, self.parent.version_check_seconds):
+            return cached.get("channel") or {}
+
+        data = self._fetch()
+        channel = isinstance(data, dict) and data.get("channel")
+        if isinstance(channel, dict):
+            runez.save_json({"manifest": self.path, "channel": channel}, self.cache_path, fatal=False)
+            return channel
+
+        LOG.warning("Can't read manifest %s, using %s", short(self.path), "cached copy" if cached else "no manifest")
+        return cached.get("channel") or {}
+
+    def get_definition(self, key):
+        """
+        :param str key: Key to look up
+        :return Definition|None: Definition corresponding to 'key' in this manifest, if any
+        """
+        if key and (key == "channel" or key.startswith("channel.")):
+            return super(ManifestFile, self).get_definition(key)
+
+        return None
+
+    def resolved_definition(self, key, package_spec=None):
+        return None
+
+
 def get_user_index():
     """
     Returns:
@@ -288,6 +380,7 @@ class Settings(object):
     base = None  # type: FolderBase # Installation folder
     meta = None  # type: FolderBase # .pickley meta subfolder
     venvs = None  # type: FolderBase # .pickley/_venvs meta subfolder
+    state = None  # type: StateStore # Metadata of installed packages
 
     def __init__(self):
         self.set_base(None)
@@ -296,10 +389,15 @@ class Settings(object):
         self.defaults.set_contents(
             default=dict(
                 channel=system.LATEST_CHANNEL,
+                connect_timeout=DEFAULT_CONNECT_TIMEOUT,
                 delivery=system.DEFAULT_DELIVERY,
+                error_check_delay=DEFAULT_ERROR_CHECK_DELAY,
+                hedge_delay=DEFAULT_HEDGE_DELAY,
                 install_timeout=DEFAULT_INSTALL_TIMEOUT,
                 packager=system.VENV_PACKAGER,
+                read_timeout=DEFAULT_READ_TIMEOUT,
                 version_check_delay=DEFAULT_VERSION_CHECK_DELAY,
+                wheel_cache_size=DEFAULT_WHEEL_CACHE_SIZE,
             ),
         )
         user_index = get_user_index()
@@ -325,6 +423,10 @@ class Settings(object):
         if self.config:
             self._add_config(self.config)
 
+        manifest = self.get_definition("manifest")
+        if manifest and manifest.value:
+            self.children.append(ManifestFile(self, manifest.value, base=getattr(manifest.source, "folder", None)))
+
     def set_base(self, base):
         """
         :param str | None base: Folder to use as base for installations
@@ -353,9 +455,24 @@ class Settings(object):
 
         self.meta = FolderBase(os.path.join(self.base.path, DOT_PICKLEY), name="meta")
         self.venvs = FolderBase(os.path.join(self.meta.path, "_venvs"), name="venvs")
+        self.state = StateStore(self.meta.path)
 
         runez.Anchored.add(self.base.path)
 
+    @property
+    def connect_timeout(self):
+        """
+        :return int: How many seconds to wait for a connection to pypi index to be established
+        """
+        return runez.to_int(self.get_value("connect_timeout"), default=DEFAULT_CONNECT_TIMEOUT)
+
+    @property
+    def read_timeout(self):
+        """
+        :return int: How many seconds to wait for pypi index to respond, once connected
+        """
+        return runez.to_int(self.get_value("read_timeout"), default=DEFAULT_READ_TIMEOUT)
+
     @property
     def install_timeout(self):
         """
@@ -363,6 +480,22 @@ class Settings(object):
         """
         return runez.to_int(self.get_value("install_timeout"), default=DEFAULT_INSTALL_TIMEOUT)
 
+    @property
+    def error_check_seconds(self):
+        """
+        :return float: How many seconds to wait before retrying a failed version check (doubles with each consecutive failure)
+        """
+        return runez.to_int(self.get_value("error_check_delay"), default=DEFAULT_ERROR_CHECK_DELAY) * 60
+
+    @property
+    def version_cache(self):
+        """
+        :return str|None: Optional path to host-wide cache of latest versions, shared by all pickley installations
+        """
+        path = self.get_value("version_cache")
+        if path:
+            return runez.resolved_path(path)
+
     @property
     def version_check_seconds(self):
         """
@@ -370,6 +503,22 @@ class Settings(object):
         """
         return runez.to_int(self.get_value("version_check_delay"), default=DEFAULT_VERSION_CHECK_DELAY) * 60
 
+    @property
+    def wheel_cache(self):
+        """
+        :return str|None: Optional path to host-wide cache of wheels, shared by all packages and pickley installations
+        """
+        path = self.get_value("wheel_cache")
+        if path:
+            return runez.resolved_path(path)
+
+    @property
+    def wheel_cache_bytes(self):
+        """
+        :return int: Size (in bytes) that wheel cache should not exceed
+        """
+        return runez.to_int(self.get_value("wheel_cache_size"), default=DEFAULT_WHEEL_CACHE_SIZE) * 1024 * 1024
+
     def _add_config(self, path, base=None):
         """
         :param str path: Path to config file
@@ -440,12 +589,40 @@ class Settings(object):
             return value.value
         return default
 
+    @property
+    def gc_bytes(self):
+        """
+        :return int|None: Optional size (in bytes) that older installs and tool venvs should not exceed, see 'pickley gc'
+        """
+        budget = runez.to_int(self.get_value("gc_budget"))
+        if budget and budget > 0:
+            return budget * 1024 * 1024
+
+    @property
+    def hedge_delay(self):
+        """
+        :return float: How many seconds to wait for an index mirror to respond before querying the next one as well
+        """
+        try:
+            return float(self.get_value("hedge_delay"))
+
+        except (TypeError, ValueError):
+            return DEFAULT_HEDGE_DELAY
+
     @property
     def index(self):
         """
-        :return str: Optional pypi index to use
+        :return str: Optional pypi index to use (first configured one, if several mirrors are configured)
+        """
+        indexes = self.indexes
+        return indexes[0] if indexes else None
+
+    @property
+    def indexes(self):
+        """
+        :return list: Configured pypi index mirrors, if any (setting can be a list, or a space separated string)
         """
-        return self.get_value("index")
+        return [url for url in runez.flattened([self.get_value("index")], split=" ") if url]
 
     def represented(self, include_defaults=True):
         """
@@ -0,0 +1,191 @@
+"""
+Per-package metadata, kept in one sqlite database: <base>/.pickley/state.db
+
+Each row holds one json document, keyed by (package, kind), where kind is one of:
+- current: currently installed version (formerly .current.json)
+- latest: latest version as determined by querying pypi (formerly .latest.json)
+- entry-points: entry points of installed version (formerly .entry-points.json)
+- removed-entry-points: entry points removed by an upgrade, not cleaned up yet (formerly .removed-entry-points.json)
+- installs: installs currently in use, and prefix index of installed artifacts (used by 'pickley gc')
+
+Files used by older pickley versions are migrated (and deleted) the first time they're seen.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import runez
+
+from pickley import system
+
+
+LOG = logging.getLogger(__name__)
+KINDS = ("current", "latest", "entry-points", "removed-entry-points")
+SCHEMA = "CREATE TABLE IF NOT EXISTS state (package TEXT NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (package, kind))"
+
+
+def legacy_path(folder, kind):
+    """
+    :param str folder: Meta folder of a package
+    :param str kind: Kind of metadata
+    :return str: Path to file where older pickley versions stored metadata of 'kind'
+    """
+    return os.path.join(folder, ".%s.json" % kind)
+
+
+class StateStore(object):
+    """
+    Metadata of all installed packages, updated transactionally, readable and writable concurrently by several pickley processes
+    """
+
+    def __init__(self, meta):
+        """
+        :param str meta: Path to .pickley meta folder
+        """
+        self.meta = meta
+        self.path = os.path.join(meta, "state.db")
+        self._local = threading.local()  # One connection per thread
+        self._preloaded = None  # type: dict # (package, kind) -> data, when all rows were read at once via preload()
+
+    def __repr__(self):
+        return runez.short(self.path)
+
+    def _connection(self):
+        """
+        :return sqlite3.Connection: Connection to use for current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            exists = os.path.exists(self.path)
+            if runez.DRYRUN and not exists:
+                # Don't create database in dryrun mode, but still show what previous pickley versions installed
+                connection = sqlite3.connect(":memory:")
+
+            else:
+                runez.ensure_folder(self.meta, folder=True, logger=None)
+                connection = sqlite3.connect(self.path, timeout=60)
+
+            with connection:
+                connection.execute(SCHEMA)
+
+            self._local.connection = connection
+            if not exists:
+                self._migrate_all(connection)
+
+        return connection
+
+    def _migrate_all(self, connection):
+        """Import all metadata files left behind by older pickley versions, in one transaction"""
+        if not os.path.isdir(self.meta):
+            return
+
+        migrated = []
+        names = [fname for fname in os.listdir(self.meta) if system.PackageSpec.is_valid(fname)]
+        # Dashed folders last: their data wins over stale folders left behind by pickley < 1.8 (named after pythonified names)
+        names = sorted(names, key=lambda x: (x == system.PackageSpec(x).dashed, x))
+        with connection:
+            for fname in names:
+                folder = os.path.join(self.meta, fname)
+                if os.path.isdir(folder):
+                    package = system.PackageSpec(fname).dashed
+                    for kind in KINDS:
+                        path = legacy_path(folder, kind)
+                        data = runez.read_json(path, default=None, fatal=False)
+                        if data is not None:
+                            connection.execute("REPLACE INTO state VALUES (?, ?, ?)", (package, kind, json.dumps(data, sort_keys=True)))
+                            migrated.append(path)
+
+        if migrated and not runez.DRYRUN:
+            LOG.debug("Migrated %s metadata files to %s", len(migrated), self)
+            for path in migrated:
+                runez.delete(path, fatal=False, logger=None)
+
+    def _migrate(self, package, kind):
+        """
+        :param str package: Dashed package name
+        :param str kind: Kind of metadata
+        :return: Contents of file left behind by an older pickley version, if any (imported in database)
+        """
+        path = legacy_path(os.path.join(self.meta, package), kind)
+        if not os.path.exists(path):
+            return None
+
+        data = runez.read_json(path, default=None, fatal=False)
+        if data is not None and not runez.DRYRUN:
+            self.put(package, kind, data)
+            runez.delete(path, fatal=False, logger=None)
+
+        return data
+
+    def preload(self):
+        """Read all rows at once (allows to list many packages with one query)"""
+        rows = self._connection().execute("SELECT package, kind, data FROM state").fetchall()
+        self._preloaded = dict(((package, kind), json.loads(data)) for package, kind, data in rows)
+
+    def get(self, package, kind, default=None):
+        """
+        :param str package: Dashed package name
+        :param str kind: Kind of metadata
+        :param default: Default to return if there is no such metadata
+        :return: Stored metadata for 'package'
+        """
+        if self._preloaded is not None and (package, kind) in self._preloaded:
+            return self._preloaded[(package, kind)]
+
+        row = self._connection().execute("SELECT data FROM state WHERE package=? AND kind=?", (package, kind)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+        data = self._migrate(package, kind)
+        return default if data is None else data
+
+    def put(self, package, kind, data):
+        """
+        :param str package: Dashed package name
+        :param str kind: Kind of metadata
+        :param data: Data to store (None: delete metadata)
+        """
+        if runez.DRYRUN:
+            LOG.debug("Would update %s:%s of %s", package, kind, self)
+            return
+
+        connection = self._connection()
+        with connection:
+            if data is None:
+                connection.execute("DELETE FROM state WHERE package=? AND kind=?", (package, kind))
+
+            else:
+                connection.execute("REPLACE INTO state VALUES (?, ?, ?)", (package, kind, json.dumps(data, sort_keys=True)))
+
+        if self._preloaded is not None:
+            if data is None:
+                self._preloaded.pop((package, kind), None)
+
+            else:
+                self._preloaded[(package, kind)] = data
+
+    def delete(self, package):
+        """
+        :param str package: Dashed package name, all its metadata gets deleted
+        """
+        if runez.DRYRUN:
+            LOG.debug("Would delete %s from %s", package, self)
+            return
+
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM state WHERE package=?", (package,))
+
+        if self._preloaded is not None:
+            for key in [k for k in self._preloaded if k[0] == package]:
+                del self._preloaded[key]
+
+    def installed(self):
+        """
+        :return list[str]: Dashed names of packages that have a 'current' metadata
+        """
+        rows = self._connection().execute("SELECT package FROM state WHERE kind='current' ORDER BY package").fetchall()
+        return [row[0] for row in rows]
@@ -2,11 +2,14 @@
 Functionality for the whole app, easily importable via one name
 """
 
+import contextlib
 import inspect
 import logging
 import os
 import re
 import sys
+import threading
+from multiprocessing.pool import ThreadPool
 
 import runez
 from click import UsageError
@@ -33,6 +36,10 @@ RE_PYPI_DASHED_NAME = re.compile(r"^[a-z0-9-]+$")
 
 PICKLEY_PROGRAM_PATH = runez.resolved_path(sys.argv[0])
 
+# Concurrent installs: how many threads can use a given class of resource ("network", "cpu") at the same time
+THROTTLES = {}
+_DEFERRED = threading.local()
+
 
 def setup_audit_log():
     """Setup audit.log, if not already setup"""
@@ -52,11 +59,116 @@ def inform(message):
     Args:
         message (str): Message to print and log at level INFO
     """
-    print(message)
+    deferred = getattr(_DEFERRED, "messages", None)
+    if deferred is None:
+        print(message)
+
+    else:
+        deferred.append(message)
+
     logger = logging.getLogger(inspect.currentframe().f_back.f_globals["__name__"])
     logger.info(message)
 
 
+def concurrently(func, items, jobs=1):
+    """
+    :param callable func: Function to call on each item
+    :param list items: Items to process
+    :param int jobs: Maximum number of concurrent calls to 'func'
+    :return: Results of 'func' for each item, in the same order as 'items', yielded as soon as available
+    """
+    jobs = min(runez.to_int(jobs, default=1), len(items))
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+
+        return
+
+    def captured(item):
+        # Pool workers only report 'Exception', runez.abort() raises SystemExit: pass everything through to caller
+        try:
+            return None, func(item)
+
+        except BaseException as e:
+            return e, None
+
+    pool = ThreadPool(jobs)
+    try:
+        for error, result in pool.imap(captured, items):
+            if error is not None:
+                raise error
+
+            yield result
+
+    finally:
+        pool.terminate()
+
+
+class DeferredConsole(logging.Filter):
+    """Collects what would be logged to console by threads running under deferred_inform(), instead of showing it right away"""
+
+    def __init__(self, handler):
+        """
+        :param logging.Handler handler: Console handler this filter is attached to
+        """
+        logging.Filter.__init__(self)
+        self.handler = handler
+
+    def filter(self, record):
+        deferred = getattr(_DEFERRED, "messages", None)
+        if deferred is None:
+            return True
+
+        deferred.append(self.handler.format(record))
+        return False
+
+
+@contextlib.contextmanager
+def deferred_inform():
+    """
+    Context manager collecting messages passed to inform() by current thread, instead of printing them right away
+    Warnings and errors logged by current thread (runez.abort() for example) are collected as well
+    Allows concurrent work to report its outcome in a deterministic order
+    """
+    handler = runez.log.console_handler
+    if handler is not None and not any(isinstance(f, DeferredConsole) for f in handler.filters):
+        handler.addFilter(DeferredConsole(handler))
+
+    _DEFERRED.messages = []
+    try:
+        yield _DEFERRED.messages
+
+    finally:
+        _DEFERRED.messages = None
+
+
+def set_throttles(**limits):
+    """
+    :param limits: Max number of threads allowed to concurrently use each resource class (None or 0: unlimited)
+    """
+    THROTTLES.clear()
+    for name, limit in limits.items():
+        limit = runez.to_int(limit)
+        if limit and limit > 0:
+            THROTTLES[name] = threading.BoundedSemaphore(limit)
+
+
+@contextlib.contextmanager
+def throttled(name):
+    """
+    Context manager holding one slot of resource class 'name' (if throttled, see set_throttles())
+
+    :param str name: Resource class, "network" for downloads and index queries, "cpu" for builds
+    """
+    semaphore = THROTTLES.get(name)
+    if semaphore is None:
+        yield
+        return
+
+    with semaphore:
+        yield
+
+
 def despecced(text):
     """
     :param str text: Text of form <name>==<version>, or just <name>
@@ -155,12 +267,7 @@ def resolved_package_specs(names, auto_complete=False):
             result.append(name)
 
     elif auto_complete and os.path.isdir(SETTINGS.meta.path):
-        for fname in sorted(os.listdir(SETTINGS.meta.path)):
-            if PackageSpec.is_valid(fname):
-                fpath = os.path.join(SETTINGS.meta.path, fname)
-                if os.path.isdir(fpath):
-                    if os.path.exists(os.path.join(fpath, ".current.json")):
-                        result.append(fname)
+        result = [name for name in SETTINGS.state.installed() if PackageSpec.is_valid(name)]
 
     return [PackageSpec(name) for name in runez.flattened(result, unique=True)]
 
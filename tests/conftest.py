@@ -1,4 +1,16 @@
+import gzip
+import io
 import os
+import threading
+import time
+
+try:  # python3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+except ImportError:  # python2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
 
 import pytest
 import runez
@@ -47,3 +59,74 @@ cli.context = TemporaryBase
 def temp_base():
     with TemporaryBase() as base:
         yield base
+
+
+class IndexServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in for a pypi index, serving 'pages' (path -> body or (status, headers, body))"""
+
+    daemon_threads = True
+
+    def __init__(self, pages=None, delay=0):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), IndexRequestHandler)
+        self.pages = pages or {}
+        self.delay = delay
+        self.connections = 0
+        self.requests = []
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s" % self.server_port
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict((k.lower(), v) for k, v in self.headers.items())))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        page = self.server.pages.get(self.path)
+        status, headers, body = 200, {}, page
+        if page is None:
+            status, body = 404, "not found"
+
+        elif isinstance(page, tuple):
+            status, headers, body = page
+            etag = headers.get("ETag")
+            if status == 200 and etag and etag == self.headers.get("If-None-Match"):
+                status, body = 304, None
+
+        body = (body or "").encode("utf-8")
+        if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as fh:
+                fh.write(body)
+            body = buffer.getvalue()
+            headers = dict(headers, **{"Content-Encoding": "gzip"})
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
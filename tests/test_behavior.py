@@ -1,12 +1,16 @@
+import logging
 import os
+import threading
+import time
 
 import pytest
 import runez
 from mock import patch
 
+import pickley.lock
 from pickley import system
 from pickley.context import ImplementationMap
-from pickley.lock import SharedVenv, SoftLock, SoftLockException
+from pickley.lock import SoftLock, SoftLockException, ToolVenv
 from pickley.settings import Settings
 
 from .conftest import verify_abort
@@ -23,22 +27,126 @@ def test_lock(temp_base):
         runez.delete(str(lock))
         assert not lock._locked()
 
-        if runez.PY2:
-            with patch("pickley.lock.virtualenv_path", return_value=None):
-                assert "Can't determine path to virtualenv.py" in verify_abort(SharedVenv, lock, None)
+    # Legacy polling, when flock() is not available
+    with patch("pickley.lock.fcntl", None):
+        with SoftLock(folder, timeout=10) as lock:
+            assert lock._locked()
+            with pytest.raises(SoftLockException):
+                with SoftLock(folder, timeout=0.01):
+                    pass
 
 
-@patch("runez.run", return_value=runez.program.RunResult("pex==1.0", "", 0))
-@patch("runez.file.is_younger", return_value=True)
-def test_ensure_freeze(_, __, temp_base):
-    # Test edge case for _installed_module()
-    with SoftLock(temp_base) as lock:
-        fake_pex = os.path.join(temp_base, "bin/pex")
-        runez.touch(fake_pex)
-        runez.make_executable(fake_pex)
-        if runez.PY2:
-            v = SharedVenv(lock, None)
-            assert v._installed_module(system.PackageSpec("pex"))
+@pytest.mark.skipif(pickley.lock.fcntl is None, reason="flock() not available")
+def test_flock(temp_base):
+    folder = os.path.join(temp_base, "foo")
+    held = threading.Event()
+    pids = []
+
+    def hold():
+        with SoftLock(folder) as lock:
+            pids.extend(runez.readlines(str(lock)))
+            held.set()
+            time.sleep(0.3)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    assert pids == [str(os.getpid())]
+    started = time.time()
+    with SoftLock(folder, timeout=1):
+        # Waiter was woken up as soon as lock got released (no polling)
+        assert time.time() - started < 0.9
+        assert os.path.exists(folder + ".lock")
+
+    thread.join()
+    assert not os.path.exists(folder + ".lock")
+
+    # A left-over lock file (from a crashed process for example) does not hold the lock
+    runez.write(folder + ".lock", "0\n")
+    assert not SoftLock(folder)._locked()
+    with SoftLock(folder):
+        pass
+
+
+def fake_dist_info(folder, name, version):
+    path = os.path.join(folder, "lib", "python3.7", "site-packages", "%s-%s.dist-info" % (name, version), "METADATA")
+    runez.write(path, "Metadata-Version: 2.1\nName: %s\nVersion: %s\n\nName: not-a-header\n" % (name, version))
+
+
+class FakeToolRun(object):
+    """Simulates venv creation and pip install, recording which tools got effectively installed"""
+
+    def __init__(self):
+        self.installed = []
+
+    def __call__(self, program, *args, **kwargs):
+        args = runez.flattened(args, shellify=True)
+        if args[0] == "-mvenv":
+            runez.touch(os.path.join(args[1], "bin", "python"))
+
+        elif args[:2] == ["-mpip", "install"]:
+            self.installed.append(args[-1])
+            name, version = system.despecced(args[-1])
+            folder = os.path.dirname(os.path.dirname(program))
+            fake_dist_info(folder, name, version or "1.5")
+            fake_dist_info(folder, "wheel", "0.33")
+
+        return runez.program.RunResult("", "", 0)
+
+
+def tool_folder(python, spec):
+    with ToolVenv.get(python, system.PackageSpec(spec)) as venv:
+        return venv.folder
+
+
+def test_tool_venvs(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    python = system.target_python(fatal=False)
+    fake_run = FakeToolRun()
+    with patch("runez.run", side_effect=fake_run):
+        with ToolVenv.get(python, system.PackageSpec("pex")) as pex:
+            assert pex.folder.endswith("_tools/%s/pex-1.5" % python.short_name)
+            assert runez.read_json(pex.frozen_path) == {"pex": "1.5", "wheel": "0.33"}
+            assert fake_run.installed == ["pex"]
+
+        # Switching between versions doesn't reinstall anything
+        assert tool_folder(python, "pex==1.6").endswith("pex-1.6")
+        assert tool_folder(python, "pex==1.5") == pex.folder
+        assert tool_folder(python, "pex==1.6").endswith("pex-1.6")
+        assert fake_run.installed == ["pex", "pex==1.6"]
+
+        # Unversioned: most recently used entry
+        assert tool_folder(python, "pex").endswith("pex-1.6")
+        assert fake_run.installed == ["pex", "pex==1.6"]
+
+        # Scratch build folder is cleaned up
+        root = os.path.dirname(pex.folder)
+        assert sorted(os.listdir(root)) == ["pex-1.5", "pex-1.6"]
+
+        # Entries not used for a while get evicted, unless they're in use
+        old = time.time() - (pickley.lock.TOOL_KEEP_DAYS + 1) * 24 * 60 * 60
+        with ToolVenv.get(python, system.PackageSpec("pex==1.5")):
+            os.utime(pex.folder, (old, old))
+            assert tool_folder(python, "virtualenv").endswith("virtualenv-1.5")
+            assert sorted(os.listdir(root)) == ["pex-1.5", "pex-1.6", "virtualenv-1.5"]
+
+        assert tool_folder(python, "virtualenv==1.6").endswith("virtualenv-1.6")
+        assert sorted(os.listdir(root)) == ["pex-1.6", "virtualenv-1.5", "virtualenv-1.6"]
+
+        with runez.CaptureOutput(dryrun=True):
+            ToolVenv.get(python, system.PackageSpec("pex==2.0"))
+            assert fake_run.installed[-1] == "pex==2.0"
+            assert not os.path.exists(os.path.join(root, "pex-2.0"))
+
+    with patch("runez.run", return_value=runez.program.RunResult("", "", 0)):
+        assert "Can't determine version of foo" in verify_abort(ToolVenv.get, python, system.PackageSpec("foo"))
+
+    # Versions are read from dist-info metadata, names are dashed
+    pex = ToolVenv(pex.folder.replace("pex-1.5", "pex-1.6"))
+    assert pex.scanned_frozen() == {"pex": "1.6", "wheel": "0.33"}
+    assert runez.read_json(pex.frozen_path) == pex.scanned_frozen()
+    fake_dist_info(pex.folder, "Foo_Bar", "1.0")
+    assert pex.scanned_frozen() == {"foo-bar": "1.0", "pex": "1.6", "wheel": "0.33"}
 
 
 def test_config():
@@ -62,3 +170,81 @@ def test_missing_implementation():
 def test_sorting():
     some_list = sorted([system.PackageSpec("tox"), system.PackageSpec("awscli")])
     assert [str(s) for s in some_list] == ["awscli", "tox"]
+
+
+def test_concurrently():
+    assert list(system.concurrently(lambda x: x * 2, [])) == []
+    assert list(system.concurrently(lambda x: x * 2, [1, 2, 3])) == [2, 4, 6]
+    assert list(system.concurrently(lambda x: x * 2, [1, 2, 3], jobs=8)) == [2, 4, 6]
+
+    def failing(x):
+        if x == 2:
+            raise SystemExit("failed %s" % x)
+        return x
+
+    with pytest.raises(SystemExit):
+        list(system.concurrently(failing, [1, 2, 3], jobs=2))
+
+
+def test_throttles():
+    active = []
+    peak = []
+
+    def work(x):
+        with system.throttled("cpu"):
+            active.append(x)
+            peak.append(len(active))
+            time.sleep(0.01)
+            active.remove(x)
+
+        with system.deferred_inform() as messages:
+            system.inform("done %s" % x)
+            return messages
+
+    try:
+        system.set_throttles(cpu=2, network=0)
+        assert sorted(system.THROTTLES) == ["cpu"]
+        results = list(system.concurrently(work, [1, 2, 3, 4, 5, 6], jobs=6))
+        assert results == [["done %s" % x] for x in range(1, 7)]
+        assert max(peak) <= 2
+
+    finally:
+        system.set_throttles()
+
+    assert not system.THROTTLES
+    with system.throttled("cpu"):
+        with runez.CaptureOutput() as logged:
+            system.inform("not deferred")
+            assert "not deferred" in logged
+
+
+class RecordingHandler(logging.Handler):
+    """Stand-in for console log handler"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+
+def test_deferred_errors():
+    handler = RecordingHandler()
+    logger = logging.getLogger("pickley.test")
+    logger.addHandler(handler)
+    try:
+        with patch("runez.log.console_handler", handler):
+            with system.deferred_inform() as messages:
+                system.inform("installed foo")
+                logger.error("failed bar")
+
+            # Errors are reported along with other messages, in order
+            assert messages == ["installed foo", "failed bar"]
+            assert not handler.records
+
+            logger.error("not deferred")
+            assert handler.records == ["not deferred"]
+
+    finally:
+        logger.removeHandler(handler)
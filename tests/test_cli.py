@@ -30,8 +30,9 @@ def test_invocation(cli):
         "-p, --packager",
     )
     cli.expect_success("auto-upgrade --help", "auto-upgrade [OPTIONS] PACKAGE")
-    cli.expect_success("check --help", "check [OPTIONS] [PACKAGES]..", "-v, --verbose")
-    cli.expect_success("install --help", "install [OPTIONS] PACKAGES..", "-f, --force")
+    cli.expect_success("check --help", "check [OPTIONS] [PACKAGES]..", "-j, --jobs", "-v, --verbose")
+    cli.expect_success("install --help", "install [OPTIONS] PACKAGES..", "-f, --force", "-j, --jobs", "--cpu-jobs")
+    cli.expect_success("gc --help", "gc [OPTIONS]", "--budget")
     cli.expect_success("package --help", "package [OPTIONS] FOLDER", "-b, --build", "-d, --dist")
 
     cli.expect_success("settings -d", "settings:", "base: %s" % os.getcwd())
@@ -48,6 +49,22 @@ def test_auto_upgrade_locked(cli):
             cli.expect_success("--dryrun auto-upgrade foo", "installed by another process")
 
 
+def test_install_schedules_gc(cli):
+    with patch("pickley.garbage.schedule") as schedule:
+        with patch("pickley.package.Packager.install", return_value=False):
+            cli.expect_success("install foo")
+            cli.expect_success("install --jobs 2 foo bar")
+            assert not schedule.called  # Nothing to clean up when everything was already installed
+
+        with patch("pickley.package.Packager.install", side_effect=[True, False]):
+            cli.expect_success("install --jobs 2 foo bar")
+            assert schedule.call_count == 1
+
+        with patch("pickley.package.Packager.install", return_value=True):
+            cli.expect_success("install foo")
+            assert schedule.call_count == 2
+
+
 def run_program(program, *args):
     if not os.path.isabs(program):
         program = os.path.abspath(program)
@@ -125,7 +142,7 @@ def test_install(cli):
     # Old entry point removed immediately
     assert not os.path.exists("tox-old1")
 
-    # Only 1 cleaned up immediately (latest + 1 kept)
+    # Only 1 cleaned up right after install (latest + 1 kept)
     assert not os.path.exists(".pickley/tox/tox-0.1")
     assert not os.path.exists(".pickley/tox/tox-0.2")
     assert os.path.exists(".pickley/tox/tox-0.3")
@@ -147,6 +164,8 @@ def test_install(cli):
     # Verify that older versions and removed entry-points do get cleaned up
     runez.save_json({"install_timeout": 0}, "custom-timeout.json")
     cli.expect_success("-ccustom-timeout.json install tox", "already installed")
+    assert os.path.exists(".pickley/tox/tox-0.3")  # No-op installs don't cleanup
+    cli.expect_success("-ccustom-timeout.json gc", "Deleted", "older installs")
 
     # All cleaned up when enough time went by
     assert not os.path.exists(".pickley/tox/tox-0.3")
@@ -154,15 +173,17 @@ def test_install(cli):
 
     cli.expect_success("check", "tox", "is installed")
     cli.expect_success("check --verbose", "tox", "is installed (as %s wrap, channel: " % system.VENV_PACKAGER)
+    cli.expect_success("check --jobs 4", "tox", "is installed")
 
     # Simulate new version available
-    latest = runez.read_json(".pickley/tox/.latest.json")
+    latest = system.SETTINGS.state.get("tox", "latest")
     latest["version"] = "10000.0"
-    runez.save_json(latest, ".pickley/tox/.latest.json")
+    system.SETTINGS.state.put("tox", "latest", latest)
     cli.expect_failure("check", "tox", "can be upgraded to 10000.0")
 
     # Latest twine 2.0 requires py3
     cli.expect_success("-ppex install twine==1.14.0", "Installed twine")
+    cli.expect_success("install --jobs 2 tox twine==1.14.0", "tox", "twine", "is already installed")
 
     cli.expect_success("list", "tox", "twine")
     cli.expect_success("list --verbose", "tox", "twine")
@@ -172,8 +193,8 @@ def test_install(cli):
 
     cli.expect_success("uninstall twine", "Uninstalled twine")
 
-    runez.write(".pickley/tox/.current.json", "")
-    cli.expect_failure("check", "tox", "Couldn't read", "is not installed")
+    system.SETTINGS.state.put("tox", "current", "")
+    cli.expect_failure("check", "tox", "is not installed")
 
     cli.expect_success("uninstall --all", "Uninstalled tox", "entry points")
     assert not os.path.exists("tox")
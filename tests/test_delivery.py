@@ -1,14 +1,18 @@
 import logging
 import os
+import time
 
 import runez
 from mock import patch
 from runez.program import RunResult
 
 from pickley import system
-from pickley.delivery import _relocator, DeliveryMethodWrap, relocate_venv
+from pickley.delivery import _relocator, clone_file, copy_venv, DeliveryMethodCopy, DeliveryMethodWrap
+from pickley.delivery import find_venvs, relocate_file, relocate_venv
 from pickley.uninstall import uninstall_existing
 
+from .conftest import verify_abort
+
 
 def test_wrapper(temp_base):
     repeater = os.path.join(temp_base, "repeat.sh")
@@ -51,6 +55,40 @@ def test_wrapper(temp_base):
     assert not os.path.exists(target)
 
 
+def test_wrapper_ping(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    pickley = system.SETTINGS.base.full_path(system.PICKLEY)
+    runez.write(pickley, "#!/bin/bash\n")
+    runez.make_executable(pickley)
+    foo = os.path.join(temp_base, "foo-source")
+    runez.write(foo, "#!/bin/bash\n\necho foo $*\n")
+    runez.make_executable(foo)
+
+    target = os.path.join(temp_base, "foo")
+    d = DeliveryMethodWrap(system.PackageSpec("foo"))
+    d.hook = "echo "
+    d.bg = ""
+    d.install(target, foo)
+    assert "-mmin -%s" % (system.SETTINGS.version_check_seconds // 60) in "\n".join(runez.readlines(target))
+
+    # No .ping yet: auto-upgrade is triggered
+    result = runez.run(target, "bar")
+    assert "nohup %s auto-upgrade foo" % pickley in result.output
+
+    # Recent .ping: pickley is not started at all
+    ping = system.SETTINGS.meta.full_path("foo", ".ping")
+    runez.touch(ping)
+    result = runez.run(target, "bar")
+    assert "nohup" not in result.output
+    assert "foo-source bar" in result.output
+
+    # Old .ping: auto-upgrade is triggered again
+    old = time.time() - system.SETTINGS.version_check_seconds - 60
+    os.utime(ping, (old, old))
+    result = runez.run(target, "bar")
+    assert "nohup" in result.output
+
+
 def test_relocate_venv(temp_base):
     with patch("pickley.delivery.relocate_venv", return_value=-1):
         assert _relocator("source", "destination") == " (relocation failed)"
@@ -65,22 +103,39 @@ def test_relocate_venv(temp_base):
         runez.make_executable("foo/bar/bin/python")
         assert "Created" in logged.pop()
 
-        # Simulate already seen
+        # Venvs are not looked for in pruned folders
         expected = ["line 1: source", "line 2"]
-        assert relocate_venv("foo", "source", "dest", fatal=False, _seen={"foo"}) == 0
-        assert list(runez.readlines("foo/bar/bin/baz")) == expected
-        assert not logged
+        runez.write("foo/site-packages/bar/bin/baz", original, logger=logging.debug)
+        runez.write("foo/site-packages/bar/bin/python", "", logger=logging.debug)
+        runez.make_executable("foo/site-packages/bar/bin/python")
+        assert list(find_venvs("foo")) == [os.path.realpath("foo/bar/bin")]
 
         # Simulate failure to write
-        with patch("runez.write", return_value=-1):
+        with patch("os.rename", side_effect=OSError("denied")):
             assert relocate_venv("foo", "source", "dest", fatal=False) == -1
         assert list(runez.readlines("foo/bar/bin/baz")) == expected
-        assert not logged
+        assert "Can't relocate foo/bar/bin/baz: denied" in logged.pop()
+        assert sorted(os.listdir("foo/bar/bin")) == ["baz", "empty", "python"]  # Temp file was cleaned up
+
+        with runez.CaptureOutput(dryrun=True) as dryrun_logged:
+            assert relocate_venv("foo", "source", "dest", fatal=False) == 1
+            assert "Would relocate" in dryrun_logged
+        assert list(runez.readlines("foo/bar/bin/baz")) == expected
+
+        # Binary files are not relocated
+        with open("foo/bar/bin/binary", "wb") as fh:
+            fh.write(b"\0\1source")
+        assert relocate_file("foo/bar/bin/binary", b"source", b"dest") == 0
+        runez.delete("foo/bar/bin/binary", logger=None)
 
         # Simulate effective relocation, by folder
         expected = ["line 1: dest", "line 2"]
         assert relocate_venv("foo", "source", "dest", fatal=False) == 1
         assert list(runez.readlines("foo/bar/bin/baz")) == expected
+        with open("foo/bar/bin/baz") as fh:
+            assert fh.read() == "line 1: dest\nline 2\n"  # Trailing newline is preserved
+
+        assert runez.is_executable("foo/bar/bin/baz")
         assert not logged
 
         # Second relocation is a no-op
@@ -90,3 +145,60 @@ def test_relocate_venv(temp_base):
         runez.write("foo/bar/bin/baz", original, logger=logging.debug)
         assert relocate_venv("foo/bar/bin/baz", "source", "dest", fatal=False) == 1
         assert list(runez.readlines("foo/bar/bin/baz")) == expected
+
+        # Many files are relocated via a pool of workers
+        for i in range(20):
+            runez.write("foo/bar/bin/script%s" % i, original, logger=None)
+        assert relocate_venv("foo", "source", "dest", fatal=False) == 20
+        assert list(runez.readlines("foo/bar/bin/script7")) == expected
+
+
+def test_clone(temp_base):
+    runez.write("source/bin/foo", "#!%s/source/bin/python\n" % temp_base)
+    runez.write("source/bin/python", "")
+    runez.write("source/lib/data", "some data\n")
+    runez.make_executable("source/bin/foo")
+    runez.make_executable("source/bin/python")
+    os.symlink("data", "source/lib/link")
+
+    # Hardlinks are used when allowed (if reflinks are not supported)
+    with patch("pickley.delivery.FICLONE", None):
+        assert clone_file("source/lib/data", "hardlinked", hardlink=True) == "hardlink"
+        assert os.stat("hardlinked").st_ino == os.stat("source/lib/data").st_ino
+
+        if hasattr(os, "copy_file_range"):
+            assert clone_file("source/lib/data", "copied") == "copy_file_range"
+            with patch("os.copy_file_range", side_effect=OSError("not supported")):
+                assert clone_file("source/lib/data", "copied") == "copy"
+
+        else:
+            assert clone_file("source/lib/data", "copied") == "copy"
+
+        assert list(runez.readlines("copied")) == ["some data"]
+        assert os.stat("copied").st_ino != os.stat("source/lib/data").st_ino
+
+        with patch("os.link", side_effect=OSError("cross-device link")):
+            assert clone_file("source/bin/foo", "foo", hardlink=True) in ("copy", "copy_file_range")
+            assert runez.is_executable("foo")
+
+    # Delivery via copy: venv is relocated in destination, source is left untouched
+    target = os.path.join(temp_base, "target")
+    deliver = DeliveryMethodCopy(system.PackageSpec("foo"))
+    deliver.install(target, os.path.join(temp_base, "source"))
+    assert list(runez.readlines("target/bin/foo")) == ["#!%s/target/bin/python" % temp_base]
+    assert list(runez.readlines("source/bin/foo")) == ["#!%s/source/bin/python" % temp_base]
+    assert os.readlink("target/lib/link") == "data"
+    assert list(runez.readlines("target/lib/data")) == ["some data"]
+
+    with runez.CaptureOutput(dryrun=True) as logged:
+        assert copy_venv("source", "target2") == 1
+        assert "Would copy source -> target2" in logged
+    assert not os.path.exists("target2")
+
+    assert copy_venv("source", "source") == 0
+    assert "does not exist" in verify_abort(copy_venv, "foo/bar", "target2")
+    with patch("pickley.delivery.clone_tree", side_effect=OSError("oops")):
+        assert copy_venv("source", "target2", fatal=False) == -1
+
+    with patch("pickley.delivery.relocate_venv", return_value=-1):
+        assert copy_venv("source", "target3", fatal=False) == -1
@@ -0,0 +1,116 @@
+import os
+import time
+
+import runez
+from mock import patch
+
+from pickley import system
+from pickley.garbage import disk_usage, GarbageCollector, schedule
+from pickley.lock import SoftLock, SoftLockException
+from pickley.package import PACKAGERS
+
+
+def test_garbage(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    state = system.SETTINGS.state
+    state.put("foo", "current", {"version": "2.0", "packager": system.VENV_PACKAGER})
+    state.put("foo", "entry-points", {"foo": ""})
+    state.put("foo", "installs", {"current": ["foo-2.0"]})
+    old = time.time() - 60
+    for version in ("1.0", "2.0"):
+        path = system.SETTINGS.meta.full_path("foo", "foo-%s" % version, "bin", "foo")
+        runez.write(path, "#" * 1000)
+        os.utime(os.path.dirname(os.path.dirname(path)), (old, old))
+
+    assert disk_usage(system.SETTINGS.meta.full_path("foo", "foo-1.0")) >= 1000
+    assert disk_usage(system.SETTINGS.meta.full_path("foo", "no-such-file")) == 0
+
+    # Young enough: latest 2 installs are kept, groups are remembered in prefix index
+    gc = GarbageCollector()
+    assert gc.run()
+    assert str(gc) == "deleted 0 older installs and 0 tool venvs"
+    assert state.get("foo", "installs")["groups"] == {"foo-1.0": "foo", "foo-2.0": "foo"}
+
+    # Over budget: least recently used install goes first, current install is never deleted
+    gc = GarbageCollector(budget=1500)
+    assert gc.run()
+    assert gc.deleted == 1
+    assert not os.path.exists(system.SETTINGS.meta.full_path("foo", "foo-1.0"))
+    assert os.path.exists(system.SETTINGS.meta.full_path("foo", "foo-2.0"))
+
+    with runez.CaptureOutput() as logged:
+        gc = GarbageCollector(budget=10)
+        assert gc.run()
+        assert gc.deleted == 0
+        assert "over budget" in logged
+
+    # Shared tool venvs of older pickley versions are deleted
+    legacy = system.SETTINGS.venvs.full_path("_py37")
+    runez.touch(os.path.join(legacy, "bin", "python"))
+    runez.touch(legacy + ".lock")
+    runez.touch(system.SETTINGS.venvs.full_path("_py27.lock"))
+    runez.touch(system.SETTINGS.venvs.full_path("_tools", "py37", "foo", "bin", "python"))
+    gc = GarbageCollector()
+    assert gc.run()
+    assert gc.evicted == 1
+    assert sorted(os.listdir(system.SETTINGS.venvs.path)) == ["_tools"]
+
+    # Only one collection at a time
+    with patch("pickley.garbage.SoftLock.__enter__", side_effect=SoftLockException("foo")):
+        assert not GarbageCollector().run()
+
+    # Without an installed pickley, collection is done right away
+    with patch("pickley.garbage.GarbageCollector.run") as run:
+        schedule()
+        assert run.called
+
+    # With an installed pickley, collection runs in the background
+    pickley = system.SETTINGS.base.full_path(system.PICKLEY)
+    runez.write(pickley, "#!/bin/sh\n")
+    runez.make_executable(pickley)
+    with patch("subprocess.Popen") as popen:
+        with patch("pickley.garbage.GarbageCollector.run") as run:
+            schedule()
+            assert popen.call_args[0][0] == [pickley, "--base", system.SETTINGS.base.path, "gc"]
+            assert not run.called
+
+
+def test_budget(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    state = system.SETTINGS.state
+    now = time.time()
+    installs = {"foo-1.0": now - 1000, "foo-2.0": now - 10, "bar-1.0": now - 500, "bar-2.0": now - 400}
+    for name, mtime in installs.items():
+        package = name.partition("-")[0]
+        path = system.SETTINGS.meta.full_path(package, name, "bin", package)
+        runez.write(path, "#" * 1000)
+        os.utime(os.path.dirname(os.path.dirname(path)), (mtime, mtime))
+
+    state.put("foo", "current", {"version": "2.0", "packager": system.VENV_PACKAGER})
+    state.put("foo", "installs", {"current": ["foo-2.0"]})
+    state.put("bar", "current", {"version": "2.0", "packager": system.VENV_PACKAGER})  # Installed by an older pickley
+
+    # bar-1.0 was superseded longer ago than foo-1.0 (even though it was installed later)
+    gc = GarbageCollector(budget=3500)
+    assert gc.run()
+    assert gc.deleted == 1
+    assert not os.path.exists(system.SETTINGS.meta.full_path("bar", "bar-1.0"))
+    assert os.path.exists(system.SETTINGS.meta.full_path("foo", "foo-1.0"))
+
+    # Installs of a package currently being installed are left alone
+    p = PACKAGERS.resolved(system.PackageSpec("foo"))
+    with SoftLock(p.dist_folder):
+        gc = GarbageCollector(budget=10)
+        assert gc.run()
+        assert gc.deleted == 0
+        assert os.path.exists(system.SETTINGS.meta.full_path("foo", "foo-1.0"))
+
+    # Most recent install is kept when it's not known which ones are in use
+    with runez.CaptureOutput() as logged:
+        gc = GarbageCollector(budget=10)
+        assert gc.run()
+        assert gc.deleted == 1
+        assert "over budget" in logged
+
+    assert os.listdir(system.SETTINGS.meta.full_path("bar")) == ["bar-2.0"]
+    assert os.listdir(system.SETTINGS.meta.full_path("foo")) == ["foo-2.0"]
@@ -1,10 +1,14 @@
+import contextlib
 import os
+import stat
 import time
 
 import runez
 from mock import patch
+from runez.program import RunResult
 
 from pickley import system
+from pickley.cache import VersionCache
 from pickley.package import DELIVERERS, find_prefix, PACKAGERS, VersionMeta
 from pickley.settings import Definition
 
@@ -94,6 +98,7 @@ def test_version_meta():
 @patch("pickley.package.latest_pypi_version", return_value=None)
 @patch("pickley.package.DELIVERERS.resolved", return_value=None)
 def test_versions(_, __, temp_base):
+    system.SETTINGS.set_base(temp_base)
     p = PACKAGERS.get("pex")(system.PackageSpec("foo"))
     assert not p.package_spec.version
     p.pip_wheel = lambda *_: None
@@ -104,9 +109,29 @@ def test_versions(_, __, temp_base):
     p.refresh_desired()
     assert "can't determine latest version" in p.desired.representation(verbose=True)
 
-    with patch("pickley.package.latest_pypi_version", return_value="error: test failed"):
+    assert p.latest.failures == 1
+    with patch("pickley.package.latest_pypi_version", return_value="error: test failed") as latest:
+        # Recent failure is remembered, index is not queried again
         p.refresh_desired()
+        assert "can't determine latest version" in p.desired.representation()
+        assert not latest.called
+
+        p.refresh_desired(force=True)
         assert p.desired.representation() == "foo: test failed"
+        assert p.latest.failures == 2
+
+        # Backoff doubles with each consecutive failure
+        p.latest.timestamp -= 90
+        assert p.latest.still_failing
+        p.latest.timestamp -= 60
+        assert not p.latest.still_failing
+        p.latest.save()
+
+    with patch("pickley.package.latest_pypi_version", return_value="1.0"):
+        p.refresh_desired()
+        assert p.desired.version == "1.0"
+        assert not p.latest.error
+        assert not p.latest.failures
 
     system.SETTINGS.cli.contents["channel"] = "stable"
     p.refresh_desired()
@@ -118,13 +143,13 @@ def test_versions(_, __, temp_base):
     assert p.get_entry_points() is None
 
     # With an empty build fodler
-    runez.ensure_folder(p.build_folder, folder=True)
+    runez.ensure_folder(p.wheel_dir, folder=True)
     assert not p.get_entry_points()
 
     # With a bogus wheel
     with runez.CaptureOutput() as logged:
         p.package_spec.version = "0.0.0"
-        whl = os.path.join(p.build_folder, "foo-0.0.0-py2.py3-none-any.whl")
+        whl = os.path.join(p.wheel_dir, "foo-0.0.0-py2.py3-none-any.whl")
         runez.touch(whl)
         assert not p.get_entry_points()
         assert "Can't read wheel" in logged
@@ -178,3 +203,321 @@ def test_channel(*_):
         p.executables = ["foo/bar"]
         assert p.create_symlinks("foo:baz", fatal=False) == 1
         assert "Would symlink /bar <- baz/bar" in logged.pop()
+
+
+def test_version_cache(temp_base):
+    system.SETTINGS.cli.contents["version_cache"] = os.path.join(temp_base, "shared")
+    foo = system.PackageSpec("foo")
+    with patch("pickley.package.latest_pypi_version", return_value="1.0") as latest:
+        system.SETTINGS.set_base(os.path.join(temp_base, "base1"))
+        p = PACKAGERS.get(system.VENV_PACKAGER)(foo)
+        p.refresh_latest()
+        assert p.latest.version == "1.0"
+        assert latest.call_count == 1
+
+        shared = VersionCache(system.SETTINGS.version_cache)
+        assert shared.get(None, foo)["version"] == "1.0"
+        assert shared.get("https://example.com/simple", foo) is None
+
+        # Cache folders are writable by other users' pickley installations as well
+        assert stat.S_IMODE(os.stat(shared.folder).st_mode) == 0o777
+        assert stat.S_IMODE(os.stat(os.path.dirname(shared.path(None, foo))).st_mode) == 0o777
+
+        # Other base on same host: version comes from shared cache, without querying the index
+        system.SETTINGS.set_base(os.path.join(temp_base, "base2"))
+        p = PACKAGERS.get(system.VENV_PACKAGER)(foo)
+        p.refresh_latest()
+        assert p.latest.version == "1.0"
+        assert latest.call_count == 1
+        assert system.SETTINGS.state.get("foo", "latest")["version"] == "1.0"
+
+        # Expired shared entries are not used
+        data = shared.get(None, foo)
+        data["timestamp"] -= system.SETTINGS.version_check_seconds + 1
+        runez.save_json(data, shared.path(None, foo))
+        assert shared.get(None, foo) is None
+        p.refresh_latest(force=True)
+        assert latest.call_count == 2
+        assert shared.get(None, foo)["version"] == "1.0"
+
+        with runez.CaptureOutput(dryrun=True) as logged:
+            shared.put("https://example.com/simple", foo, p.latest)
+            assert "Would update" in logged
+            assert shared.get("https://example.com/simple", foo) is None
+
+    del system.SETTINGS.cli.contents["version_cache"]
+
+
+def test_shared_pex(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    p = PACKAGERS.get("pex")(system.PackageSpec("foo"))
+    p._entry_points = {"foo": "", "foo-bar": ""}
+    p.desired.set_version_channel_source("1.0", "adhoc", "cli")
+    p.package = lambda: p.effective_package("{name}-{version}")
+    system.SETTINGS.cli.contents["delivery"] = "symlink"
+
+    def fake_vrun(package_spec, command, *args, **_):
+        for arg in args:
+            if arg.startswith("-o"):
+                runez.write(arg[2:], "pex")
+
+    with patch("pickley.package.vrun", side_effect=fake_vrun) as vrun:
+        p.effective_install()
+
+        # Only one pex was built, without a '-c' entry point
+        assert vrun.call_count == 1
+        assert not any(a.startswith("-c") for a in vrun.call_args[0][2:])
+
+    shared_pex = system.SETTINGS.meta.full_path("foo", "foo-1.0.pex")
+    assert list(runez.readlines(shared_pex)) == ["pex"]
+    launcher = system.SETTINGS.meta.full_path("foo", "foo-bar-1.0")
+    assert runez.is_executable(launcher)
+    contents = list(runez.readlines(launcher))
+    assert "export PEX_SCRIPT=foo-bar" in contents
+    assert 'exec %s "$@"' % shared_pex in contents
+    assert os.path.islink(system.SETTINGS.base.full_path("foo-bar"))
+    del system.SETTINGS.cli.contents["delivery"]
+    assert not os.path.exists(p.shared_pex)
+
+    # Shared pex is not mistaken for an older version of the 'foo' entry point
+    old = time.time() - system.SETTINGS.install_timeout * 60 - 10
+    os.utime(shared_pex, (old, old))
+    os.utime(system.SETTINGS.meta.full_path("foo", "foo-1.0"), (old, old))
+    p.cleanup()
+    assert os.path.exists(shared_pex)
+    assert os.path.exists(system.SETTINGS.meta.full_path("foo", "foo-1.0"))
+
+    # pex doesn't go to pypi when a wheelhouse is configured as index
+    wheels = os.path.join(temp_base, "wheels")
+    system.SETTINGS.cli.contents["index"] = "file://%s" % wheels
+    with patch("pickley.package.vrun") as vrun:
+        p.pex_build("foo", os.path.join(temp_base, "foo.pex"))
+        args = vrun.call_args[0]
+        assert args[args.index("--no-pypi") + 1:args.index("--no-pypi") + 3] == ("--repo", wheels)
+
+    del system.SETTINGS.cli.contents["index"]
+
+    # Packaging from source: one standalone pex per entry point, so that artifacts can be moved around
+    p.source_folder = temp_base
+    p.packaged = []
+    dist = os.path.join(temp_base, "dist")
+    p.dist_folder = dist
+    with patch("pickley.package.vrun", side_effect=fake_vrun) as vrun:
+        p.effective_package("{name}")
+        assert vrun.call_count == 2
+        assert p.shared_pex is None
+        assert p.packaged == [os.path.join(dist, "foo"), os.path.join(dist, "foo-bar")]
+        assert list(runez.readlines(os.path.join(dist, "foo-bar"))) == ["pex"]
+
+
+def fake_pip(*names):
+    """Simulated 'pip download' and 'pip wheel', producing files 'names' in their output folder"""
+
+    def run(package_spec, command, *args, **_):
+        folder = args[args.index("--dest" if args[0] == "download" else "--wheel-dir") + 1]
+        for name in names:
+            runez.write(os.path.join(folder, name), name.partition("-")[0])
+
+    return run
+
+
+def test_pip_wheel_phases(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    p = PACKAGERS.get(system.VENV_PACKAGER)(system.PackageSpec("foo"))
+    p.desired.set_version_channel_source("1.0", "adhoc", "cli")
+    held = []
+    phases = []
+
+    @contextlib.contextmanager
+    def throttled(name):
+        held.append(name)
+        yield
+        held.remove(name)
+
+    def fake_vrun(*args):
+        phases.append((args[2], list(held)))
+        fake_pip(*produced)(*args)
+
+    with patch("pickley.system.throttled", side_effect=throttled):
+        with patch("pickley.package.vrun", side_effect=fake_vrun):
+            # Only wheels downloaded: nothing to compile
+            produced = ["foo-1.0-py3-none-any.whl", "six-1.12.0-py2.py3-none-any.whl"]
+            p.pip_wheel()
+            assert phases == [("download", ["network"])]
+            assert sorted(os.listdir(p.wheel_dir)) == produced
+            assert not os.path.exists(p.download_dir)
+
+            # An sdist needs compiling: that part holds a "cpu" slot, not a "network" one
+            del phases[:]
+            produced = ["foo-1.0.tar.gz"]
+            p.pip_wheel()
+            assert phases == [("download", ["network"]), ("wheel", ["cpu"])]
+            assert os.listdir(p.download_dir) == produced
+
+
+def test_wheel_cache(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    system.SETTINGS.cli.contents["wheel_cache"] = os.path.join(temp_base, "wheels")
+    p = PACKAGERS.get(system.VENV_PACKAGER)(system.PackageSpec("foo"))
+    p.desired.set_version_channel_source("1.0", "adhoc", "cli")
+    cache = p.wheel_cache
+    assert str(cache) == "wheels"
+    assert p.wheel_folders() == [p.wheel_dir, cache.folder]
+
+    with patch("pickley.package.vrun", side_effect=fake_pip("foo-1.0-py2.py3-none-any.whl", "six-1.12.0-py2.py3-none-any.whl")) as vrun:
+        p.pip_wheel()
+        assert ["--find-links", cache.folder] in vrun.call_args[0]
+        assert sorted(os.listdir(cache.folder)) == ["foo-1.0-py2.py3-none-any.whl", "six-1.12.0-py2.py3-none-any.whl"]
+        assert stat.S_IMODE(os.stat(cache.folder).st_mode) == 0o777
+
+        # Wheel of a project packaged from a local folder is not shared
+        runez.delete(cache.folder)
+        p.source_folder = temp_base
+        p.pip_wheel()
+        assert os.listdir(cache.folder) == ["six-1.12.0-py2.py3-none-any.whl"]
+
+    # Wheels already cached are marked as recently used, least recently used ones are evicted past budget
+    old = time.time() - 100
+    six = os.path.join(cache.folder, "six-1.12.0-py2.py3-none-any.whl")
+    os.utime(six, (old, old))
+    assert cache.store(p.wheel_dir) == 1
+    assert os.path.getmtime(six) > old
+
+    # Only wheels produced by last 'pip wheel' run are stored (leftovers of previous runs don't count as recently used)
+    os.utime(six, (old, old))
+    with patch("pickley.package.vrun", side_effect=fake_pip("bar-1.0-py3-none-any.whl")):
+        p.pip_wheel()
+        assert os.listdir(p.wheel_dir) == ["bar-1.0-py3-none-any.whl"]
+        assert os.path.getmtime(six) < old + 1
+
+    cache.budget = 8
+    assert cache.evict() == 1
+    assert sorted(os.listdir(cache.folder)) == ["bar-1.0-py3-none-any.whl", "foo-1.0-py2.py3-none-any.whl"]
+
+    with runez.CaptureOutput(dryrun=True) as logged:
+        assert cache.store(p.wheel_dir) == 0
+        assert "Would update" in logged
+
+    assert cache.store(os.path.join(temp_base, "no-such-folder")) == 0
+    del system.SETTINGS.cli.contents["wheel_cache"]
+
+
+def test_incremental_venv(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    p = PACKAGERS.get(system.VENV_PACKAGER)(system.PackageSpec("foo"))
+    p._entry_points = {"foo": ""}
+    p.desired.set_version_channel_source("2.0", "adhoc", "cli")
+    assert p.incremental_source() is None  # Not installed yet
+
+    p.current.set_version_channel_source("1.0", "adhoc", "cli")
+    p.current.packager = system.VENV_PACKAGER
+    assert p.incremental_source() is None  # No venv for current version
+
+    previous = system.SETTINGS.meta.full_path("foo", "foo-1.0")
+    runez.write(os.path.join(previous, "bin", "python"), "")
+    runez.make_executable(os.path.join(previous, "bin", "python"))
+    runez.write(os.path.join(previous, "bin", "pip"), "#!%s/bin/python\n" % previous)
+    runez.write(os.path.join(previous, "lib", "six.py"), "six\n")
+    for name in ("foo", "old_dep", "pip", "six"):
+        path = os.path.join(previous, "lib", "python3.7", "site-packages", "%s-1.0.dist-info" % name, "METADATA")
+        runez.write(path, "Name: %s\nVersion: 1.0\n" % name)
+
+    assert p.incremental_source() == previous
+    assert p.stale_distributions(previous, ["foo==2.0", "six==1.12.0"]) == ["old-dep"]
+
+    p.desired.version = "1.0"
+    assert p.incremental_source() is None  # Forced re-install of same version gets a fresh venv
+    p.desired.version = "2.0"
+
+    folder = os.path.join(p.dist_folder, "foo-2.0")
+    pip = os.path.join(folder, "bin", "pip")
+    p.previous_venv = p.incremental_source()
+    with patch("pickley.package.vrun") as vrun:
+        # Without a pinned wheel set, pip would leave older dependencies than a fresh install: venv is created from scratch
+        with patch("runez.run", return_value=RunResult("", "", 0)):
+            p.effective_package("{name}-{version}")
+            assert vrun.call_args[0][2] == folder
+            assert not os.path.exists(os.path.join(folder, "lib", "six.py"))
+
+        runez.touch(os.path.join(p.wheel_dir, "foo-2.0-py3-none-any.whl"))
+        runez.touch(os.path.join(p.wheel_dir, "six-1.12.0-py2.py3-none-any.whl"))
+        vrun.reset_mock()
+        with patch("runez.run", return_value=RunResult("", "", 0)) as run:
+            p.effective_package("{name}-{version}")
+            assert not vrun.called
+            assert run.call_count == 2
+            assert run.call_args_list[0][0] == (pip, "uninstall", "-y", ["old-dep"])  # No longer needed by foo 2.0
+            assert run.call_args[0][:2] == (pip, "install")
+            assert list(runez.readlines(os.path.join(folder, "lib", "six.py"))) == ["six"]
+            assert list(runez.readlines(pip)) == ["#!%s/bin/python" % folder]
+            assert p.executables == [os.path.join(folder, "bin", "foo")]
+
+        # Fresh venv is created if incremental upgrade fails
+        with patch("runez.run", side_effect=[RunResult("", "", 0), RunResult("", "oops", 1), RunResult("", "", 0)]) as run:
+            p.effective_package("{name}-{version}")
+            assert vrun.call_args[0][2] == folder
+            assert run.call_count == 3
+            assert not os.path.exists(os.path.join(folder, "lib", "six.py"))
+
+        # pip of a clone that was not relocated would act on current install: fresh venv is created instead
+        vrun.reset_mock()
+        with patch("pickley.delivery.relocate_venv", return_value=-1):
+            with patch("runez.run", return_value=RunResult("", "", 0)) as run:
+                p.effective_package("{name}-{version}")
+                assert vrun.call_args[0][2] == folder
+                assert run.call_count == 1
+                assert not os.path.exists(os.path.join(folder, "lib", "six.py"))
+
+        vrun.reset_mock()
+        with patch("pickley.delivery.relocate_venv", return_value=0):  # Clone still refers to previous venv
+            with patch("runez.run", return_value=RunResult("", "", 0)) as run:
+                p.effective_package("{name}-{version}")
+                assert vrun.call_args[0][2] == folder
+                assert run.call_count == 1
+
+
+def test_pinned_requirements(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    p = PACKAGERS.get(system.VENV_PACKAGER)(system.PackageSpec("foo_bar"))
+    p._entry_points = {"foo-bar": ""}
+    p.desired.set_version_channel_source("1.0", "adhoc", "cli")
+    assert p.pinned_requirements() is None
+
+    runez.ensure_folder(os.path.join(p.wheel_dir, "http"), folder=True)
+    runez.touch(os.path.join(p.wheel_dir, "six-1.12.0-py2.py3-none-any.whl"))
+    assert p.pinned_requirements() is None  # Package itself was not built
+
+    runez.touch(os.path.join(p.wheel_dir, "foo_bar-1.0-py3-none-any.whl"))
+    assert p.pinned_requirements() == ["foo-bar==1.0", "six==1.12.0"]
+
+    folder = os.path.join(p.dist_folder, "foo-bar-1.0")
+    with patch("pickley.package.vrun"):
+        with patch("runez.run") as run:
+            p.effective_package("{name}-{version}")
+            assert run.call_args[0] == (os.path.join(folder, "bin", "pip"), "install", "--no-index", "--no-deps", "-f", p.wheel_dir,
+                                        ["foo-bar==1.0", "six==1.12.0"])
+
+        # Ambiguous wheel set: let pip resolve, as usual
+        runez.touch(os.path.join(p.wheel_dir, "six-1.13.0-py2.py3-none-any.whl"))
+        assert p.pinned_requirements() is None
+        with patch("runez.run") as run:
+            p.effective_package("{name}-{version}")
+            assert run.call_args[0][-1] == "foo-bar==1.0"
+
+    runez.delete(os.path.join(p.wheel_dir, "six-1.13.0-py2.py3-none-any.whl"))
+    runez.touch(os.path.join(p.wheel_dir, "bogus.whl"))
+    assert p.pinned_requirements() is None
+
+    # Upgrades pin what their own 'pip wheel' run produced, regardless of what earlier runs left behind
+    with patch("pickley.package.vrun", side_effect=fake_pip("foo_bar-1.0-py3-none-any.whl", "six-1.12.0-py2.py3-none-any.whl")):
+        p.pip_wheel()
+        assert p.pinned_requirements() == ["foo-bar==1.0", "six==1.12.0"]
+
+    p.desired.version = "1.1"
+    with patch("pickley.package.vrun", side_effect=fake_pip("foo_bar-1.1-py3-none-any.whl", "six-1.12.0-py2.py3-none-any.whl")):
+        p.pip_wheel()
+        assert p.pinned_requirements() == ["foo-bar==1.1", "six==1.12.0"]
+
+    # Package itself must be pinned to desired version
+    p.desired.version = "1.2"
+    assert "produced foo-bar 1.1, expecting 1.2" in verify_abort(p.pinned_requirements)
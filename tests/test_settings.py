@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 
@@ -7,10 +8,12 @@ from mock import patch
 
 import pickley.settings
 from pickley import system
-from pickley.pypi import latest_pypi_version, request_get
+from pickley.package import PACKAGERS, VersionMeta
+from pickley.pypi import IndexClient, IndexResponse, latest_pypi_version, MIRRORS, parsed_version, pex_index_args, pip_index_args
+from pickley.pypi import install_index, request_get, same_version
 from pickley.settings import Settings, short
 
-from .conftest import sample_path
+from .conftest import IndexServer, sample_path
 
 
 LEGACY_SAMPLE = """
@@ -27,6 +30,11 @@ LEGACY_SAMPLE = """
 </body></html>
 """
 
+LEGACY_FOO = """
+<a href="/pypi/foo/foo-1.1.tar.gz#sha256=...">foo-1.1.tar.gz</a><br/>
+<a href="/pypi/foo/foo-1.2.tar.gz#sha256=...">foo-1.2.tar.gz</a><br/>
+"""
+
 PRERELEASE_SAMPLE = """
 <html><head><title>Simple Index</title><meta name="api-version" value="2" /></head><body>
 <a href="/pypi/packages/pypi-public/black/black-18.3a0-py3-none-any.whl#sha256=..."</a><br/>
@@ -80,6 +88,11 @@ settings:
 """
 
 
+def index_page(body):
+    """Simulated successful index response with 'body'"""
+    return body and IndexResponse("", 200, {}, body)
+
+
 def check_specs(text, expected):
     packages = system.resolved_package_specs(text)
     names = [p.dashed for p in packages]
@@ -135,6 +148,45 @@ def test_custom_settings(temp_base):
     assert stgs.version_check_seconds == 60
 
 
+@patch("pickley.package.latest_pypi_version", side_effect=Exception("should not be called"))
+def test_manifest(_, temp_base):
+    system.SETTINGS.set_base(temp_base)
+    manifest = {"channel": {"latest": {"tox": "3.2.1"}, "stable": {"tox": "3.0.0"}}}
+    runez.save_json(manifest, "manifest.json")
+    runez.save_json({"manifest": "manifest.json"}, "custom.json")
+    system.SETTINGS.load_config(config="custom.json")
+    assert system.SETTINGS.get_value("channel.stable.tox") == "3.0.0"
+    assert system.SETTINGS.get_definition("manifest").value == "manifest.json"
+
+    p = PACKAGERS.get(system.VENV_PACKAGER)(system.PackageSpec("tox"))
+    p.refresh_desired()
+    assert p.desired.version == "3.2.1"
+    assert p.desired.source == "manifest.json:channel.latest.tox"
+    assert runez.read_json(".pickley/manifest.json")["channel"] == manifest["channel"]
+
+    with IndexServer({"/manifest.json": json.dumps(manifest)}) as server:
+        runez.save_json({"manifest": server.url + "/manifest.json"}, "custom.json")
+        system.SETTINGS.load_config(config="custom.json")
+        assert system.SETTINGS.get_value("channel.latest.tox") == "3.2.1"
+        assert len(server.requests) == 1
+
+        # Cached copy is used while recent enough
+        system.SETTINGS.load_config(config="custom.json")
+        assert system.SETTINGS.get_value("channel.latest.tox") == "3.2.1"
+        assert len(server.requests) == 1
+
+        # Stale cached copy is used if manifest can't be fetched
+        os.utime(".pickley/manifest.json", (0, 0))
+        server.pages.clear()
+        system.SETTINGS.load_config(config="custom.json")
+        with runez.CaptureOutput() as logged:
+            assert system.SETTINGS.get_value("channel.latest.tox") == "3.2.1"
+            assert "using cached copy" in logged.pop()
+        assert len(server.requests) == 2
+
+    system.SETTINGS.load_config()
+
+
 def test_settings_base():
     old_program = system.PICKLEY_PROGRAM_PATH
 
@@ -184,31 +236,31 @@ def test_pypi(*_):
 
     assert latest_pypi_version(None, tox)
 
-    with patch("pickley.pypi.request_get", return_value="{foo"):
+    with patch("pickley.pypi.index_response", return_value=index_page("{foo")):
         # 404
         assert latest_pypi_version(None, foo).startswith("error: ")
 
-    with patch("pickley.pypi.request_get", return_value='{"info": {"version": "1.0"}}'):
+    with patch("pickley.pypi.index_response", return_value=index_page('{"info": {"version": "1.0"}}')):
         assert latest_pypi_version(None, foo) == "1.0"
 
-    with patch("pickley.pypi.request_get", return_value=None):
+    with patch("pickley.pypi.index_response", return_value=index_page(None)):
         assert latest_pypi_version(None, twine).startswith("error: ")
 
-    with patch("pickley.pypi.request_get", return_value="foo"):
+    with patch("pickley.pypi.index_response", return_value=index_page("foo")):
         assert latest_pypi_version(None, twine).startswith("error: ")
 
-    with patch("pickley.pypi.request_get", return_value=LEGACY_SAMPLE):
+    with patch("pickley.pypi.index_response", return_value=index_page(LEGACY_SAMPLE)):
         assert latest_pypi_version("https://pypi-mirror.mycompany.net/pypi", shell_functools) == "1.9.1"
         assert latest_pypi_version("https://pypi-mirror.mycompany.net/pypi/{name}", shell_functools) == "1.9.1"
 
-    with patch("pickley.pypi.request_get", return_value=PRERELEASE_SAMPLE):
+    with patch("pickley.pypi.index_response", return_value=index_page(PRERELEASE_SAMPLE)):
         assert latest_pypi_version("https://pypi-mirror.mycompany.net/pypi", black).startswith("error: ")
 
-    with patch("pickley.pypi.request_get", return_value=UNKNOWN_VERSIONING_SAMPLE):
+    with patch("pickley.pypi.index_response", return_value=index_page(UNKNOWN_VERSIONING_SAMPLE)):
         # Unknown version: someproj-1.3.0_custom
         assert latest_pypi_version("https://pypi-mirror.mycompany.net/pypi", black).startswith("error: ")
 
-    with patch("pickley.pypi.urlopen", side_effect=Exception):
+    with patch("pickley.pypi.CLIENT.get", side_effect=Exception):
         # GET fails, and fallback curl also fails
         assert request_get("") is None
 
@@ -216,12 +268,232 @@ def test_pypi(*_):
             # GET fails, but curl succeeds
             assert request_get("") == "foo"
 
-    e = Exception()
-    e.code = 404
-    with patch("pickley.pypi.urlopen", side_effect=e):
+    with patch("pickley.pypi.CLIENT.get", return_value=IndexResponse("", 404, {}, None)):
         # With explicit 404 we don't fallback to curl
         assert request_get("") is None
 
+    with patch("pickley.pypi.CLIENT.get", return_value=IndexResponse("", 503, {}, None)):
+        with patch("runez.run", return_value=runez.program.RunResult("foo", "", 0)):
+            # Server error: fallback to curl
+            assert request_get("") == "foo"
+
+
+def test_conditional_latest():
+    foo = system.PackageSpec("foo")
+    pages = {"/simple/foo": (200, {"ETag": '"v1"', "Last-Modified": "Sat, 01 Aug 2020 10:00:00 GMT"}, LEGACY_FOO)}
+    with IndexServer(pages) as server:
+        index = server.url + "/simple"
+        cached = VersionMeta(foo)
+        assert latest_pypi_version(index, foo, cached=cached) == "1.2"
+        assert cached.etag == '"v1"'
+        assert cached.last_modified == "Sat, 01 Aug 2020 10:00:00 GMT"
+        assert "if-none-match" not in server.requests[-1][1]
+
+        # Unchanged page: 304 from index, previous version is kept without re-parsing
+        cached.version = "1.2"
+        assert latest_pypi_version(index, foo, cached=cached) == "1.2"
+        assert server.requests[-1][1]["if-none-match"] == '"v1"'
+        assert server.requests[-1][1]["if-modified-since"] == "Sat, 01 Aug 2020 10:00:00 GMT"
+        assert server.connections == 1  # Connection was released after 304, and reused
+
+        # Only a 304 means "unchanged"
+        with patch("pickley.pypi.index_response", return_value=IndexResponse("", 404, {}, None)):
+            assert latest_pypi_version(index, foo, cached=cached).startswith("error: ")
+
+        # Unchanged serial
+        server.pages["/simple/foo"] = (200, {"X-PyPI-Last-Serial": "123"}, LEGACY_FOO)
+        cached.serial = "123"
+        cached.version = "1.1"
+        assert latest_pypi_version(index, foo, cached=cached) == "1.1"
+
+        # Serial changed
+        cached.serial = "122"
+        assert latest_pypi_version(index, foo, cached=cached) == "1.2"
+        assert cached.serial == "123"
+        assert cached.etag == ""
+
+
+def test_simple_json():
+    foo = system.PackageSpec("foo")
+    page = {
+        "meta": {"api-version": "1.0"},
+        "name": "foo",
+        "files": [
+            {"filename": "foo-1.1.tar.gz", "url": "...", "hashes": {}},
+            {"filename": "foo-1.2-py2.py3-none-any.whl", "url": "...", "hashes": {}},
+            {"filename": "foo-1.3.tar.gz", "url": "...", "hashes": {}, "yanked": "broken"},
+            {"filename": "foo-1.4rc1.tar.gz", "url": "...", "hashes": {}},
+            {"filename": "foo-1.5.zip", "url": "...", "hashes": {}},
+        ],
+    }
+    headers = {"Content-Type": "application/vnd.pypi.simple.v1+json"}
+    with IndexServer({"/simple/foo": (200, headers, json.dumps(page))}) as server:
+        assert latest_pypi_version(server.url + "/simple", foo) == "1.2"
+        assert server.requests[0][1]["accept"].startswith("application/vnd.pypi.simple.v1+json")
+
+        # Last resort curl fallback doesn't negotiate json, but json form is still recognized
+        headers.clear()
+        assert latest_pypi_version(server.url + "/simple", foo) == "1.2"
+
+        page["files"] = page["files"][2:]
+        server.pages["/simple/foo"] = json.dumps(page)
+        assert latest_pypi_version(server.url + "/simple", foo) == "error: all published versions are pre-releases"
+
+
+@patch("pickley.pypi.CHUNK_SIZE", 16)
+def test_streamed_parsing():
+    foo = system.PackageSpec("foo")
+    releases = dict(("1.%s" % i, [{"filename": "foo-1.%s.tar.gz" % i, "python_version": "source"}]) for i in range(2000))
+    warehouse = '{"info": {"name": "foo", "version": "1.2", "summary": "brace } and \\"version\\": \\"0.1\\""}, "releases": %s}'
+    pages = {
+        "/pypi/foo/json": warehouse % json.dumps(releases),
+        "/pypi/bar/json": json.dumps({"releases": releases, "info": {"version": "1.3"}}),
+        "/pypi/baz/json": '{"info": {"version": "1.4"',
+        "/simple/foo": LEGACY_FOO * 50,
+    }
+    with IndexServer(pages) as server:
+        url = server.url + "/pypi/{name}/json"
+        assert latest_pypi_version(url, foo) == "1.2"
+        # Body was not fully read, connection could not be reused
+        assert latest_pypi_version(url, foo) == "1.2"
+        assert server.connections == 2
+
+        # "info" not first: full json parse
+        assert latest_pypi_version(url, system.PackageSpec("bar")) == "1.3"
+
+        # Truncated json
+        assert latest_pypi_version(url, system.PackageSpec("baz")).startswith("error: ")
+
+        # Legacy html, read line by line
+        assert latest_pypi_version(server.url + "/simple", foo) == "1.2"
+
+
+def test_wheelhouse(temp_base):
+    assert pip_index_args(None) == []
+    assert pip_index_args("https://example.com/simple") == ["-i", "https://example.com/simple"]
+    assert pex_index_args(None) == []
+    assert pex_index_args("https://example.com/simple") == ["--no-pypi", "--index-url", "https://example.com/simple"]
+
+    folder = os.path.join(temp_base, "wheels")
+    url = "file://%s" % folder
+    assert pip_index_args(url) == ["--no-index", "--find-links", folder]
+    assert pex_index_args(url) == ["--no-pypi", "--repo", folder]
+    assert latest_pypi_version(url, system.PackageSpec("foo-bar")).startswith("error: can't read wheelhouse")
+
+    for name in ("foo_bar-1.0-py3-none-any.whl", "foo-bar-1.2.tar.gz", "foo_bar-1.3rc1-py3-none-any.whl", "foo_baz-2.0.tar.gz", "README"):
+        runez.touch(os.path.join(folder, name))
+
+    with patch("pickley.pypi.index_response", side_effect=Exception) as response:
+        assert latest_pypi_version(url, system.PackageSpec("foo-bar")) == "1.2"
+        assert latest_pypi_version(url, system.PackageSpec("foo_baz")) == "2.0"
+        assert latest_pypi_version(url, system.PackageSpec("foo")).startswith("error: ")
+        assert not response.called
+
+
+def test_mirrors(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    system.SETTINGS.cli.contents["hedge_delay"] = 0.1
+    foo = system.PackageSpec("foo")
+    simple = '<a href="/pypi/packages/foo-%s.tar.gz#sha256=123">foo-%s.tar.gz</a>'
+    with IndexServer({"/simple/foo": simple % ("1.0", "1.0")}, delay=0.5) as slow:
+        with IndexServer({"/simple/foo": simple % ("2.0", "2.0")}) as fast:
+            with IndexServer({"/simple/foo": (500, {}, ""), "/simple/bar": (500, {}, "")}) as broken:
+                mirrors = [broken.url + "/simple", slow.url + "/simple", fast.url + "/simple"]
+                system.SETTINGS.cli.contents["index"] = " ".join(mirrors)
+                assert system.SETTINGS.indexes == mirrors
+                assert system.SETTINGS.index == mirrors[0]
+
+                # Broken mirror fails right away, slow one doesn't answer within budget: fast one is queried as well
+                assert latest_pypi_version(mirrors, foo) == "2.0"
+                broken_requests = len(broken.requests)
+                assert broken_requests
+                assert len(fast.requests) == 1
+
+                # Fastest healthy mirror is now tried first
+                stats = runez.read_json(system.SETTINGS.meta.full_path("mirrors.json"))
+                assert stats[mirrors[0]]["failures"] == 1
+                assert stats[mirrors[2]]["latency"] < stats[mirrors[1]]["latency"]
+                assert MIRRORS.ordered(mirrors) == [mirrors[2], mirrors[1], mirrors[0]]
+                assert install_index() == mirrors[2]  # Used by pip and pex as well
+                assert latest_pypi_version(mirrors, foo) == "2.0"
+                assert len(broken.requests) == broken_requests
+                assert len(fast.requests) == 2
+
+                # All mirrors failing
+                assert latest_pypi_version(mirrors, system.PackageSpec("bar")).startswith("error: ")
+
+            with IndexServer() as missing:
+                # Mirror that doesn't host a package is not considered unhealthy
+                mirrors = [missing.url + "/simple", fast.url + "/simple"]
+                assert latest_pypi_version(mirrors, foo) == "2.0"
+                assert len(missing.requests) == 1
+                stats = runez.read_json(system.SETTINGS.meta.full_path("mirrors.json"))
+                assert stats[mirrors[0]]["failures"] == 0
+
+    del system.SETTINGS.cli.contents["hedge_delay"]
+    del system.SETTINGS.cli.contents["index"]
+
+
+def test_index_client():
+    pages = {
+        "/simple/foo/": "foo page",
+        "/simple/bar": (301, {"Location": "/simple/foo/"}, ""),
+    }
+    with IndexServer(pages) as server:
+        client = IndexClient()
+        response = client.get(server.url + "/simple/foo/")
+        assert response.status == 200
+        assert response.text == "foo page"
+        assert response.headers["content-encoding"] == "gzip"
+        assert server.requests[0][1]["accept-encoding"] == "gzip"
+
+        # Redirects are followed, connection is kept alive
+        response = client.get(server.url + "/simple/bar")
+        assert response.url == server.url + "/simple/foo/"
+        assert response.text == "foo page"
+        assert client.get(server.url + "/simple/baz").status == 404
+        assert len(server.requests) == 4
+        assert server.connections == 1
+
+        # Connection closed by server is transparently re-established
+        client._idle[("http", server.url[7:])][0].sock.close()
+        assert client.get(server.url + "/simple/foo/").text == "foo page"
+        assert server.connections == 2
+
+        client.close()
+        assert not client._idle
+
+        with pytest.raises(ValueError):
+            client.get("ftp://example.com/foo")
+
+
+def test_pep440():
+    ordered = [
+        "0.9", "1.0.dev1", "1.0a1.dev1", "1.0a1", "1.0b2", "1.0rc1", "1.0", "1.0+local.a", "1.0+local.1", "1.0+local.2",
+        "1.0.post1.dev1", "1.0.post1", "1.0.1", "1.1", "1!0.1",
+    ]
+    parsed = [parsed_version(v) for v in ordered]
+    assert all(parsed)
+    assert sorted(reversed(parsed)) == parsed
+    assert [v.text for v in parsed if v.is_prerelease] == ["1.0.dev1", "1.0a1.dev1", "1.0a1", "1.0b2", "1.0rc1", "1.0.post1.dev1"]
+
+    assert parsed_version("1.0.0") == parsed_version("1.0")
+    assert parsed_version("1.0-1") == parsed_version("1.0.post1")
+    assert parsed_version("v1.0RC1") == parsed_version("1.0rc1")
+    assert parsed_version("1.0") != parsed_version("1.0.1")
+    assert parsed_version("1.0") != "1.0"
+    assert parsed_version("1.0") is parsed_version("1.0")  # Memoized
+    assert parsed_version(None) is None
+    assert parsed_version("1.3.0_custom") is None
+    assert parsed_version("1.8.1!1") is None
+    assert len(set([parsed_version("1.0"), parsed_version("1.0.0")])) == 1
+
+    assert same_version(None, None)
+    assert same_version("1.0", "1.0.0")
+    assert not same_version("1.0", "1.0.1")
+    assert not same_version("foo", "bar")
+    assert not same_version("1.0", None)
+
 
 def test_add_representation():
     # Cover add_representation() edge cases
@@ -0,0 +1,69 @@
+import os
+
+import runez
+
+from pickley import system
+from pickley.state import StateStore
+
+
+def test_state(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    meta = system.SETTINGS.meta.path
+
+    # Metadata files left behind by older pickley versions
+    runez.save_json({"version": "1.0"}, os.path.join(meta, "tox", ".current.json"))
+    runez.save_json(["tox", "tox-quickstart"], os.path.join(meta, "tox", ".entry-points.json"))
+    runez.save_json({"version": "2.0"}, os.path.join(meta, "foo_bar", ".current.json"))
+    runez.write(os.path.join(meta, "bogus", ".current.json"), "not json")
+
+    with runez.CaptureOutput(dryrun=True):
+        # Dryrun mode shows what's installed, without creating database or deleting old files
+        state = StateStore(meta)
+        assert state.installed() == ["foo-bar", "tox"]
+        state.put("tox", "latest", {"version": "1.1"})
+        state.delete("tox")
+        assert not os.path.exists(state.path)
+        assert os.path.exists(os.path.join(meta, "tox", ".current.json"))
+
+    state = StateStore(meta)
+    assert str(state) == ".pickley/state.db"
+    assert state.installed() == ["foo-bar", "tox"]
+    assert os.path.exists(state.path)
+    assert not os.path.exists(os.path.join(meta, "tox", ".current.json"))
+    assert not os.path.exists(os.path.join(meta, "foo_bar", ".current.json"))
+    assert os.path.exists(os.path.join(meta, "bogus", ".current.json"))
+
+    assert state.get("tox", "current") == {"version": "1.0"}
+    assert state.get("tox", "entry-points") == ["tox", "tox-quickstart"]
+    assert state.get("tox", "latest") is None
+    assert state.get("tox", "latest", default={}) == {}
+
+    # Files that show up later (written by an older pickley version) are migrated as well
+    runez.save_json({"version": "1.2"}, os.path.join(meta, "tox", ".latest.json"))
+    assert state.get("tox", "latest") == {"version": "1.2"}
+    assert not os.path.exists(os.path.join(meta, "tox", ".latest.json"))
+
+    state.put("tox", "removed-entry-points", ["tox-old"])
+    assert StateStore(meta).get("tox", "removed-entry-points") == ["tox-old"]
+    state.put("tox", "removed-entry-points", None)
+    assert state.get("tox", "removed-entry-points") is None
+
+    state.preload()
+    assert state.get("foo-bar", "current") == {"version": "2.0"}
+    state.put("foo-bar", "latest", {"version": "2.1"})
+    assert state.get("foo-bar", "latest") == {"version": "2.1"}
+    state.delete("foo-bar")
+    assert state.get("foo-bar", "current") is None
+    assert state.installed() == ["tox"]
+    assert system.resolved_package_specs(None, auto_complete=True)[0].dashed == "tox"
+
+
+def test_migration_precedence(temp_base):
+    system.SETTINGS.set_base(temp_base)
+    meta = system.SETTINGS.meta.path
+
+    # Stale folder left behind by pickley < 1.8 (pythonified name) does not override dashed one
+    runez.save_json({"version": "2.0"}, os.path.join(meta, "foo-bar", ".current.json"))
+    runez.save_json({"version": "1.0"}, os.path.join(meta, "foo_bar", ".current.json"))
+    state = StateStore(meta)
+    assert state.get("foo-bar", "current") == {"version": "2.0"}